@@ -5,10 +5,19 @@
 #
 
 
+import bisect
+import collections
 import datetime
+import hashlib
+import os
+import time
 import numpy
 
 from hlpr import *
+import generic
+import csv
+import kite
+import report
 
 
 IDB = {
@@ -34,101 +43,767 @@ IBS = {
 gbSpaceOutListing = True
 
 
-def _import_buy_frombegin(db, ci):
-    iDT = IDB['BTRANSDATE']
-    iRow = -1
-    #print(type(db), db.shape, db)
-    bBreak = False
-    for cr in db:
-        iRow += 1
-        if cr[iDT].timestamp() <= ci[iDT].timestamp():
+#
+# Columnar db (cdb)
+# Holds the same IDB columns as the object array based db, but as typed numpy
+# arrays, with transaction dates as int64 epoch seconds (0 if not set) and
+# asset names interned to int64 codes into the names string table.
+#
+# The columns live in growable buffers (cdb['buf']), whose capacity is doubled
+# as required, with cdb['len'] rows in use and cdb[<IDB key>] being views of
+# the rows in use. Rows are only ever appended, and the SEQ (order of arrival)
+# and SUB (order of lot splits) columns of the buffers are used along with
+# BTRANSDATE to bring the rows into db order, when the cdb is compacted.
+#
+# cdb['lots'] maps each asset's name code to a deque of the rows of its open
+# lots (lots with BQTY > SQTY), in db order, so that sells need to look only
+# at the open lots of the asset being sold.
+#
+# cdb['tkeys'] counts the transactions imported into the cdb, keyed by their
+# (symbol, time, qty, price), and cdb['sources'] tracks the csv files imported
+# incrementally, so that already imported transactions can be skipped. The
+# tkeys dict is built on first use from cdb['tkeycols'], for a loaded db.
+#
+# cdb['asum'] holds running per asset summaries, indexed by the name code,
+# which are updated as lots are bought, sold and split, so that listing the
+# assets doesnt require going through all the rows. If None, it is built on
+# first use from the rows.
+#
+CDBTYPES = {
+    'NAME': numpy.int64,
+    'BTRANSDATE': numpy.int64,
+    'BPRICE': numpy.float64,
+    'BQTY': numpy.int64,
+    'BTRANSVALUE': numpy.float64,
+    'STRANSDATE': numpy.int64,
+    'SPRICE': numpy.float64,
+    'SQTY': numpy.int64,
+    'STRANSVALUE': numpy.float64
+    }
+
+CDBDATES = [ 'BTRANSDATE', 'STRANSDATE' ]
+
+CDBORDER = [ 'SEQ', 'SUB' ]
+
+CDBMINCAPACITY = 64
+
+
+def date2epoch(date):
+    """
+    Convert a datetime object (or epoch seconds, or 0 for not set) into int64 epoch seconds.
+    """
+    if isinstance(date, (int, numpy.integer)):
+        return int(date)
+    return int(numpy.datetime64(date, 's').astype(numpy.int64))
+
+
+def dates2epoch(dates):
+    """
+    Convert a array of datetime objects (or 0 for not set) into int64 epoch seconds.
+    """
+    return numpy.asarray(dates, dtype=object).astype('datetime64[s]').astype(numpy.int64)
+
+
+def epoch2dates(epochs):
+    """
+    Convert a array of int64 epoch seconds into datetime objects, with 0 mapped back to 0.
+    """
+    epochs = numpy.asarray(epochs, dtype=numpy.int64)
+    dates = epochs.astype('datetime64[s]').astype(object)
+    dates[epochs == 0] = 0
+    return dates
+
+
+def _cdb_sync(cdb):
+    """
+    Update the column views of the cdb, to cover the rows in use in its buffers.
+    """
+    n = cdb['len']
+    for k in CDBTYPES:
+        cdb[k] = cdb['buf'][k][:n]
+
+
+def _cdb_setbuf(cdb, buf, n):
+    cdb['buf'] = buf
+    cdb['len'] = n
+    _cdb_sync(cdb)
+
+
+def cdb_new(iCapacity=CDBMINCAPACITY):
+    """
+    Create a new empty columnar db, with buffers of the given capacity.
+    """
+    cdb = { 'names': [], 'namecodes': {}, 'lots': {}, 'tkeys': {}, 'sources': {}, 'asum': {} }
+    buf = {}
+    for k in CDBTYPES:
+        buf[k] = numpy.zeros(iCapacity, dtype=CDBTYPES[k])
+    for k in CDBORDER:
+        buf[k] = numpy.zeros(iCapacity, dtype=numpy.int64)
+    _cdb_setbuf(cdb, buf, 0)
+    return cdb
+
+
+def cdb_reserve(cdb, n):
+    """
+    Ensure that the cdb has space for n more rows, doubling its capacity as required.
+    """
+    iUsed = cdb['len']
+    iNeed = iUsed + n
+    iCapacity = len(cdb['buf']['NAME'])
+    if iNeed <= iCapacity:
+        return
+    tStart = time.perf_counter() if gStats['enabled'] else 0
+    iCapacity = max(iCapacity*2, iNeed, CDBMINCAPACITY)
+    buf = {}
+    for k in cdb['buf']:
+        buf[k] = numpy.zeros(iCapacity, dtype=cdb['buf'][k].dtype)
+        buf[k][:iUsed] = cdb['buf'][k][:iUsed]
+    _cdb_setbuf(cdb, buf, iUsed)
+    if gStats['enabled']:
+        stats_time("adb.cdb_reserve.grow", time.perf_counter() - tStart)
+
+
+def cdb_compact(cdb):
+    """
+    Bring the rows of the cdb into db order i.e BTRANSDATE order, with rows of the
+    same time in order of arrival and split lots before the lot they were split from.
+    Returns the order applied, or None if the rows were already in order.
+    """
+    tStart = time.perf_counter() if gStats['enabled'] else 0
+    n = cdb['len']
+    buf = cdb['buf']
+    order = numpy.lexsort((buf['SUB'][:n], buf['SEQ'][:n], buf['BTRANSDATE'][:n]))
+    if numpy.all(order == numpy.arange(n)):
+        order = None
+    else:
+        for k in buf:
+            buf[k][:n] = buf[k][:n][order]
+        _lots_remap(cdb, order)
+    buf['SEQ'][:n] = numpy.arange(n)
+    buf['SUB'][:n] = 0
+    if gStats['enabled']:
+        stats_time("adb.cdb_compact", time.perf_counter() - tStart)
+    return order
+
+
+def _lots_rebuild(cdb):
+    """
+    Build the open lots index of the cdb from scratch, assuming its rows are in db order.
+    """
+    rows = numpy.flatnonzero((cdb['BQTY'] - cdb['SQTY']) > 0)
+    rows = rows[numpy.argsort(cdb['NAME'][rows], kind='stable')]
+    iBounds = numpy.flatnonzero(numpy.diff(cdb['NAME'][rows])) + 1
+    lots = {}
+    for assetRows in numpy.split(rows, iBounds):
+        if len(assetRows) > 0:
+            lots[int(cdb['NAME'][assetRows[0]])] = collections.deque(assetRows.tolist())
+    cdb['lots'] = lots
+
+
+def _lots_remap(cdb, order):
+    """
+    Update the open lots index, after the rows of the cdb have been reordered as per order.
+    """
+    newRows = numpy.empty_like(order)
+    newRows[order] = numpy.arange(len(order))
+    for code in cdb['lots']:
+        cdb['lots'][code] = collections.deque(newRows[list(cdb['lots'][code])].tolist())
+
+
+def _lots_add(cdb, iRow):
+    """
+    Add the lot at iRow to its asset's open lots, placing it by BTRANSDATE, after
+    any open lots with the same or earlier BTRANSDATE.
+    """
+    buf = cdb['buf']
+    code = int(buf['NAME'][iRow])
+    lots = cdb['lots'].get(code)
+    if lots == None:
+        lots = collections.deque()
+        cdb['lots'][code] = lots
+    bDate = buf['BTRANSDATE'][iRow]
+    if (len(lots) == 0) or (buf['BTRANSDATE'][lots[-1]] <= bDate):
+        lots.append(iRow)
+    else:
+        lots.insert(bisect.bisect_right(lots, bDate, key=lambda i: buf['BTRANSDATE'][i]), iRow)
+
+
+ASUMTYPES = {
+    'atRows': numpy.int64,
+    'atBQty': numpy.int64,
+    'atBSum': numpy.float64,
+    'atSQty': numpy.int64,
+    'atSSum': numpy.float64,
+    'ihRows': numpy.int64,
+    'ihBQty': numpy.int64,
+    'ihBSum': numpy.float64,
+    'pl': numpy.float64,
+    }
+
+IASUM = dict([ (k, i) for i, k in enumerate(ASUMTYPES) ])
+
+
+def _asum_rows(cdb, rows):
+    """
+    Return the contribution of each of the given rows of the cdb to its asset's summary.
+    """
+    bQty = cdb['BQTY'][rows]
+    bSum = cdb['BTRANSVALUE'][rows]
+    sQty = cdb['SQTY'][rows]
+    sSum = cdb['STRANSVALUE'][rows]
+    ih = (sQty == 0).astype(numpy.int64)
+    return {
+        'atRows': numpy.ones(len(bQty), dtype=numpy.int64),
+        'atBQty': bQty,
+        'atBSum': bSum,
+        'atSQty': sQty,
+        'atSSum': sSum,
+        'ihRows': ih,
+        'ihBQty': bQty*ih,
+        'ihBSum': bSum*ih,
+        'pl': numpy.where(sQty > 0, sSum - bSum, 0.0),
+        }
+
+
+def _asum_row_values(bQty, bSum, sQty, sSum):
+    """
+    Return the contribution of a row to its asset's summary, in ASUMTYPES order.
+    """
+    if sQty == 0:
+        return [ 1, bQty, bSum, sQty, sSum, 1, bQty, bSum, 0.0 ]
+    if sQty > 0:
+        return [ 1, bQty, bSum, sQty, sSum, 0, 0, 0.0, sSum - bSum ]
+    return [ 1, bQty, bSum, sQty, sSum, 0, 0, 0.0, 0.0 ]
+
+
+def _asum_build(cdb):
+    """
+    Build the per asset summaries of the cdb from its rows, in one pass.
+    The summaries are kept as a list of values in ASUMTYPES order for each asset
+    name code, as they are updated a value at a time as lots get sold.
+    """
+    n = len(cdb['names'])
+    contrib = _asum_rows(cdb, slice(None))
+    cols = []
+    for k in ASUMTYPES:
+        cols.append(numpy.bincount(cdb['NAME'], weights=contrib[k], minlength=n).astype(ASUMTYPES[k]).tolist())
+    asum = {}
+    for code, values in enumerate(zip(*cols)):
+        if values[IASUM['atRows']] > 0:
+            asum[code] = list(values)
+    return asum
+
+
+def _asum(cdb):
+    """
+    Return the per asset summaries of the cdb, building them if required.
+    """
+    if 'asum' not in cdb:
+        return _asum_build(cdb)
+    if type(cdb['asum']) == type(None):
+        cdb['asum'] = _asum_build(cdb)
+    return cdb['asum']
+
+
+def _asum_add(cdb, rows):
+    """
+    Add the given new rows of the cdb to their asset's summaries.
+    """
+    asum = cdb['asum']
+    if type(asum) == type(None):
+        return
+    contrib = _asum_rows(cdb, rows)
+    cols = [ contrib[k].tolist() for k in ASUMTYPES ]
+    for code, values in zip(cdb['NAME'][rows].tolist(), zip(*cols)):
+        cur = asum.get(code)
+        if cur == None:
+            asum[code] = list(values)
             continue
-        bBreak = True
-        break
-    if not bBreak:
-        iRow += 1
-    db = numpy.insert(db, iRow, numpy.array([ci[0],ci[1],ci[2],ci[3],ci[4],0,0,0,0]), 0)
-    return db
+        for i in range(len(values)):
+            cur[i] += values[i]
 
 
-def _import_buy_fromend(db, ci):
-    iDT = IDB['BTRANSDATE']
-    iRow = 0
-    iEnd = db.shape[0]-1
-    for i in range(iEnd, -1, -1):
-        if db[i, iDT].timestamp() > ci[iDT].timestamp():
+def _asum_lot(cdb, iRow):
+    """
+    Return the contribution of the lot at iRow to its asset's summary.
+    """
+    buf = cdb['buf']
+    return _asum_row_values(buf['BQTY'].item(iRow), buf['BTRANSVALUE'].item(iRow), buf['SQTY'].item(iRow), buf['STRANSVALUE'].item(iRow))
+
+
+ASUMNOLOT = [ 0, 0, 0.0, 0, 0.0, 0, 0, 0.0, 0.0 ]
+
+
+def _asum_lot_changed(cdb, iRow, before):
+    """
+    Update the summary of the asset of the lot at iRow, after the lot was changed
+    by a sell or split. before: the contribution of the lot before the change,
+    or ASUMNOLOT if the lot was newly created.
+    """
+    asum = cdb['asum']
+    if type(asum) == type(None):
+        return
+    after = _asum_lot(cdb, iRow)
+    cur = asum[cdb['buf']['NAME'].item(iRow)]
+    for i in range(len(after)):
+        cur[i] += after[i] - before[i]
+    if cur[IASUM['ihRows']] == 0:
+        # Dont let rounding errors leave behind a in hand value, once no lots are in hand
+        cur[IASUM['ihBSum']] = 0.0
+
+
+def cdb_intern(cdb, name):
+    """
+    Return the int code for the given asset name, adding it to the names table if required.
+    """
+    code = cdb['namecodes'].get(name)
+    if code == None:
+        code = len(cdb['names'])
+        cdb['names'].append(name)
+        cdb['namecodes'][name] = code
+    return code
+
+
+def cdb_from_cols(cols):
+    """
+    Create a columnar db from a dict of IDB columns, with asset names as strs and
+    dates as epoch seconds, with the rows in db order.
+    """
+    if len(cols['NAME']) == 0:
+        return cdb_new()
+    cdb = cdb_new(0)
+    names, codes = numpy.unique(numpy.asarray(cols['NAME'], dtype=object), return_inverse=True)
+    for name in names:
+        cdb_intern(cdb, name)
+    n = len(codes)
+    buf = { 'NAME': codes.astype(numpy.int64).reshape(-1) }
+    for k in CDBTYPES:
+        if k != 'NAME':
+            buf[k] = numpy.asarray(cols[k]).astype(CDBTYPES[k])
+    buf['SEQ'] = numpy.arange(n, dtype=numpy.int64)
+    buf['SUB'] = numpy.zeros(n, dtype=numpy.int64)
+    _cdb_setbuf(cdb, buf, n)
+    _lots_rebuild(cdb)
+    cdb['asum'] = None
+    return cdb
+
+
+def cdb_from_db(db):
+    """
+    Convert the object array based db into a columnar db.
+    """
+    if (type(db) == type(None)) or (len(db) == 0):
+        return cdb_new()
+    cols = {}
+    for k in CDBTYPES:
+        if k in CDBDATES:
+            cols[k] = dates2epoch(db[:,IDB[k]])
+        else:
+            cols[k] = db[:,IDB[k]]
+    return cdb_from_cols(cols)
+
+
+def cdb_to_db(cdb):
+    """
+    Convert the columnar db into the object array based db.
+    """
+    db = numpy.zeros((len(cdb['NAME']), len(IDB)), dtype=object)
+    db[:,IDB['NAME']] = numpy.array(cdb['names'], dtype=object)[cdb['NAME']]
+    for k in CDBTYPES:
+        if k == 'NAME':
             continue
-        iRow = i+1
-        break
-    db = numpy.insert(db, iRow, numpy.array([ci[0],ci[1],ci[2],ci[3],ci[4],0,0,0,0]), 0)
+        if k in CDBDATES:
+            db[:,IDB[k]] = epoch2dates(cdb[k])
+        else:
+            db[:,IDB[k]] = cdb[k].tolist()
     return db
 
 
-_import_buy = _import_buy_fromend
+def cdb_filter(cdb, mask):
+    """
+    Return a new columnar db, which contains only the rows selected by the given mask,
+    while sharing the names table with the passed cdb.
+    NOTE: The returned cdb is meant for querying and not for importing into.
+    """
+    cdbF = { 'names': cdb['names'], 'namecodes': cdb['namecodes'] }
+    for k in CDBTYPES:
+        cdbF[k] = cdb[k][mask]
+    return cdbF
+
+
+def dba_col(dba, sCol):
+    """
+    Return the specified IDB column from either a columnar db or a object array db.
+    """
+    if type(dba) == dict:
+        return dba[sCol]
+    return dba[:,IDB[sCol]]
+
+
+def save_db(db, sPath):
+    """
+    Save the db into the sPath directory, as a columnar db, with each column in
+    its own .npy file and the asset names in a string table.
+    db: either a columnar db or a object array db.
+    """
+    cdb = db if (type(db) == dict) else cdb_from_db(db)
+    cols = { 'names': numpy.array(cdb['names'], dtype=str) }
+    for k in CDBTYPES:
+        cols[k] = cdb[k]
+    tkeys = _tkeys(cdb)
+    cols['TKNAME'] = numpy.array([ k[0] for k in tkeys ], dtype=str)
+    cols['TKTIME'] = numpy.array([ k[1] for k in tkeys ], dtype=numpy.int64)
+    cols['TKQTY'] = numpy.array([ k[2] for k in tkeys ], dtype=numpy.int64)
+    cols['TKPRICE'] = numpy.array([ k[3] for k in tkeys ], dtype=numpy.float64)
+    cols['TKCOUNT'] = numpy.array(list(tkeys.values()), dtype=numpy.int64)
+    generic.save_cols(sPath, cols, { 'kind': 'adb', 'sources': cdb['sources'] })
+
+
+def load_db(sPath, bMMap=True):
+    """
+    Load a db saved using save_db, as a columnar db.
+    bMMap: if True, the columns are memory mapped instead of being read in fully.
+        They are copied into memory, only if more rows are imported into the db.
+    """
+    cols, meta = generic.load_cols(sPath, bMMap)
+    cdb = cdb_new(0)
+    for name in cols['names'].tolist():
+        cdb_intern(cdb, name)
+    n = len(cols['NAME'])
+    buf = {}
+    for k in CDBTYPES:
+        buf[k] = cols[k]
+    buf['SEQ'] = numpy.arange(n, dtype=numpy.int64)
+    buf['SUB'] = numpy.zeros(n, dtype=numpy.int64)
+    _cdb_setbuf(cdb, buf, n)
+    _lots_rebuild(cdb)
+    cdb['asum'] = None
+    if 'TKNAME' in cols:
+        cdb['tkeys'] = None
+        cdb['tkeycols'] = [ cols[k] for k in [ 'TKNAME', 'TKTIME', 'TKQTY', 'TKPRICE', 'TKCOUNT' ] ]
+    cdb['sources'] = meta.get('sources', {})
+    return cdb
+
+
+def _tkeys(cdb):
+    """
+    Return the transaction keys counts dict of the cdb, building it if required.
+    """
+    if cdb['tkeys'] == None:
+        tkCols = [ c.tolist() for c in cdb['tkeycols'] ]
+        cdb['tkeys'] = dict(zip(zip(*tkCols[:4]), tkCols[4]))
+        del(cdb['tkeycols'])
+    return cdb['tkeys']
+
+
+def _da_tkeys(da):
+    """
+    Return the (symbol, time, qty, price) keys of the transactions in the da.
+    """
+    return list(zip(da[:,IBS['NAME']].tolist(), dates2epoch(da[:,IBS['TRANSDATE']]).tolist(),
+                    da[:,IBS['QTY']].astype(numpy.int64).tolist(), da[:,IBS['PRICE']].astype(numpy.float64).tolist()))
+
+
+def _tkeys_add(cdb, da):
+    tkeys = _tkeys(cdb)
+    for k in _da_tkeys(da):
+        tkeys[k] = tkeys.get(k, 0) + 1
+
+
+def _dedup_da(tkeys, da, seen):
+    mask = numpy.ones(len(da), dtype=bool)
+    for i, k in enumerate(_da_tkeys(da)):
+        seen[k] = seen.get(k, 0) + 1
+        if seen[k] <= tkeys.get(k, 0):
+            mask[i] = False
+    return da[mask]
+
+
+def dedup_da(db, da):
+    """
+    Return the transactions in the da, which have not yet been imported into the db.
+    The n-th occurance of a (symbol, time, qty, price) in the da is treated as
+    new, only if the db has less than n such transactions.
+    db: a columnar db
+    """
+    return _dedup_da(_tkeys(db), da, {})
+
+
+def _import_buys(cdb, da):
+    """
+    Append a batch of buy transactions to the cdb in one go.
+    The rows get placed in BTRANSDATE order, when the cdb is compacted.
+    """
+    n = len(da)
+    stats_count("adb.buys", n)
+    cdb_reserve(cdb, n)
+    iRow = cdb['len']
+    buf = cdb['buf']
+    rows = slice(iRow, iRow+n)
+    buf['NAME'][rows] = [ cdb_intern(cdb, an) for an in da[:,IBS['NAME']] ]
+    buf['BTRANSDATE'][rows] = dates2epoch(da[:,IBS['TRANSDATE']])
+    buf['BPRICE'][rows] = da[:,IBS['PRICE']].astype(numpy.float64)
+    buf['BQTY'][rows] = da[:,IBS['QTY']].astype(numpy.int64)
+    buf['BTRANSVALUE'][rows] = da[:,IBS['TRANSVALUE']].astype(numpy.float64)
+    for k in [ 'STRANSDATE', 'SPRICE', 'SQTY', 'STRANSVALUE', 'SUB' ]:
+        buf[k][rows] = 0
+    buf['SEQ'][rows] = numpy.arange(iRow, iRow+n)
+    cdb['len'] += n
+    _cdb_sync(cdb)
+    _asum_add(cdb, rows)
+    for iNew in (numpy.flatnonzero(buf['BQTY'][rows] > 0) + iRow).tolist():
+        _lots_add(cdb, iNew)
+
+
+def _import_buy(cdb, ci):
+    """
+    Append the given buy transaction to the cdb.
+    """
+    _import_buys(cdb, numpy.array([ci], dtype=object))
+
+
+def _split_lot(cdb, iRow, iQty):
+    """
+    Split iQty out of the lot at iRow, into a new lot placed just before it in db order.
+    """
+    stats_count("adb.lots.split")
+    cdb_reserve(cdb, 1)
+    buf = cdb['buf']
+    iNew = cdb['len']
+    for k in buf:
+        buf[k][iNew] = buf[k][iRow]
+    buf['BQTY'][iNew] = iQty
+    buf['BTRANSVALUE'][iNew] = buf['BPRICE'][iRow]*iQty
+    buf['SUB'][iNew] = buf['SUB'][iRow] - 1
+    cdb['len'] += 1
+    _cdb_sync(cdb)
+    _asum_lot_changed(cdb, iNew, ASUMNOLOT)
+    return iNew
+
+
+def _sell_lot(cdb, iRow, ci, iQty, sDate):
+    buf = cdb['buf']
+    buf['STRANSDATE'][iRow] = sDate
+    buf['SPRICE'][iRow] = ci[IBS['PRICE']]
+    buf['SQTY'][iRow] = iQty
+    buf['STRANSVALUE'][iRow] = ci[IBS['PRICE']]*iQty
 
 
-def _import_sell(db, ci):
+def _import_sell(cdb, ci):
     """
     Insert the given sell transaction into the db, by matching it with related
-    buy transactions (going from oldest to latest buy transactions).
+    buy transactions (going from oldest to latest buy transactions), as found
+    in the open lots index.
     """
-    iRow = -1
+    stats_count("adb.sells")
+    buf = cdb['buf']
+    lots = cdb['lots'].get(cdb['namecodes'].get(ci[IBS['NAME']], -1), [])
     iRemaining = -1*ci[IBS['QTY']]
-    for cr in db:
-        iRow += 1
-        if cr[IDB['NAME']] != ci[IBS['NAME']]:
-            continue
-        buyQty = cr[IDB['BQTY']]
-        sellQty = cr[IDB['SQTY']]
+    sDate = date2epoch(ci[IBS['TRANSDATE']])
+    iLotsSold = 0
+    while len(lots) > 0:
+        iRow = lots[0]
+        buyQty = buf['BQTY'][iRow]
+        sellQty = buf['SQTY'][iRow]
         iDelta = buyQty - sellQty
         if (iDelta <= 0):
+            lots.popleft()
             continue
         iDelta = iDelta - iRemaining
+        iNew = None
+        before = _asum_lot(cdb, iRow)
+        iLotsSold += 1
         if iDelta == 0:
-            cr[IDB['STRANSDATE']] = ci[IBS['TRANSDATE']]
-            cr[IDB['SPRICE']] = ci[IBS['PRICE']]
-            cr[IDB['SQTY']] = iRemaining
-            cr[IDB['STRANSVALUE']] = ci[IBS['PRICE']]*cr[IDB['SQTY']]
-            return db
+            _sell_lot(cdb, iRow, ci, iRemaining, sDate)
+            iRemaining = 0
         elif iDelta < 0:
-            cr[IDB['STRANSDATE']] = ci[IBS['TRANSDATE']]
-            cr[IDB['SPRICE']] = ci[IBS['PRICE']]
-            cr[IDB['SQTY']] = cr[IDB['BQTY']]
-            cr[IDB['STRANSVALUE']] = ci[IBS['PRICE']]*cr[IDB['SQTY']]
+            _sell_lot(cdb, iRow, ci, buf['BQTY'][iRow], sDate)
             iRemaining = -1*iDelta
         else:
-            cr[IDB['BQTY']] = iRemaining
-            cr[IDB['BTRANSVALUE']] = cr[IDB['BPRICE']]*cr[IDB['BQTY']]
-            cr[IDB['STRANSDATE']] = ci[IBS['TRANSDATE']]
-            cr[IDB['SPRICE']] = ci[IBS['PRICE']]
-            cr[IDB['SQTY']] = iRemaining
-            cr[IDB['STRANSVALUE']] = ci[IBS['PRICE']]*cr[IDB['SQTY']]
+            iNew = _split_lot(cdb, iRow, iDelta)
+            buf = cdb['buf']
+            buf['BQTY'][iRow] = iRemaining
+            buf['BTRANSVALUE'][iRow] = buf['BPRICE'][iRow]*iRemaining
+            _sell_lot(cdb, iRow, ci, iRemaining, sDate)
             iRemaining = 0
-            db = numpy.insert(db, iRow, numpy.array([cr[0],cr[1],cr[2],iDelta,cr[2]*iDelta,0,0,0,0]), 0)
-            return db
-    input("WARN:ImportSell:OpenShortedAssetNotSupported:", ci)
+        _asum_lot_changed(cdb, iRow, before)
+        if (buf['BQTY'][iRow] - buf['SQTY'][iRow]) <= 0:
+            lots.popleft()
+        if iNew != None:
+            lots.appendleft(iNew)
+        if iRemaining == 0:
+            stats_count("adb.lots.sold", iLotsSold)
+            return
+    stats_count("adb.lots.sold", iLotsSold)
+    stats_count("adb.sells.short")
+    diag("ShortSell", "WARN:ImportSell:OpenShortedAssetNotSupported:{}".format(ci), ci)
+
+
+def _import_da(cdb, da):
+    """
+    Import the buy and sell transactions in the given da into the cdb, without compacting it.
+    Runs of buy transactions are appended in one go, while sells are matched
+    against the buys in FIFO order.
+    """
+    if len(da) == 0:
+        return
+    gDiagContext['src'] = "ImportDA"
+    gDiagContext['lineNo'] = None
+    tStart = time.perf_counter() if gStats['enabled'] else 0
+    _tkeys_add(cdb, da)
+    daIsBuy = (da[:,IBS['QTY']] > 0).astype(bool)
+    iRuns = numpy.flatnonzero(daIsBuy[1:] != daIsBuy[:-1]) + 1
+    for daRun in numpy.split(da, iRuns):
+        if daRun[0,IBS['QTY']] > 0:
+            _import_buys(cdb, daRun)
+            continue
+        for ci in daRun:
+            _import_sell(cdb, ci)
+    if gStats['enabled']:
+        stats_time("adb.import_da", time.perf_counter() - tStart)
+    stats_count("adb.import_da.records", len(da))
+
+
+def import_da_stream(db, daStream):
+    """
+    Import the buy and sell transactions from the given stream of da batches or
+    records (like from csv.iter_csv) into the db, one batch or record at a time,
+    so that the full da need not be in memory along with the db.
+    db: a columnar db, which is updated in place, or a object array db or None,
+        in which case a new object array db is returned.
+    """
+    cdb = db if (type(db) == dict) else cdb_from_db(db)
+    bCreateDB = (type(db) == type(None))
+    if bCreateDB:
+        print("WARN:ADB.ImportDB:Creating db...")
+    for da in daStream:
+        if (type(da) != numpy.ndarray) or (da.ndim == 1):
+            da = numpy.array([da], dtype=object)
+        if len(da) == 0:
+            continue
+        if bCreateDB: # Assuming its a BUY for now
+            _tkeys_add(cdb, da[:1])
+            _import_buys(cdb, da[:1])
+            da = da[1:]
+            bCreateDB = False
+        _import_da(cdb, da)
+    cdb_compact(cdb)
+    if type(db) == dict:
+        return cdb
+    return cdb_to_db(cdb)
 
 
 def import_da(db, da, daType="BUYSELL"):
+    """
+    Import the buy and sell transactions in the given da into the db.
+    db: a columnar db, which is updated in place, or a object array db or None,
+        in which case a new object array db is returned.
+    """
     #breakpoint()
-    if type(db) == type(None): # Assuming its a BUY for now
-        print("WARN:ADB.ImportDB:Creating db...")
-        db = numpy.array([[da[0,0], da[0,1], da[0,2], da[0,3], da[0,4], 0, 0, 0, 0]], dtype=object)
-        da = da[1:]
-    for ci in da:
-        if ci[IDB['BQTY']] > 0:
-            db = _import_buy(db, ci)
-        else:
-            db = _import_sell(db, ci)
-    return db
+    return import_da_stream(db, [da])
+
+
+def merge_das(das):
+    """
+    Merge the given list of transaction das into a single da, in transaction time order.
+    Transactions with the same time remain in the order of the das and within them.
+    """
+    das = [ da for da in das if (type(da) != type(None)) and (len(da) > 0) ]
+    if len(das) == 0:
+        return numpy.zeros((0, len(IBS)), dtype=object)
+    da = numpy.vstack(das)
+    return da[numpy.argsort(dates2epoch(da[:,IBS['TRANSDATE']]), kind='stable')]
+
+
+def import_csvs(db, csvFiles, iWorkers=None):
+    """
+    Import the transactions in the given csv files into the db, by parsing the
+    files in parallel and then matching their transactions in time order.
+    db: a columnar db, which is updated in place, or a object array db or None,
+        in which case a new object array db is returned.
+    csvFiles: a list of (csvType, sFile) pairs.
+    iWorkers: the number of worker processes to use for parsing the files.
+    """
+    return import_da(db, merge_das(csv.import_csvs(csvFiles, iWorkers)))
+
+
+def _file_fingerprint(sFile, iPrefix=-1):
+    """
+    Return the size, mtime and sha1 of the given file, along with the sha1 of
+    its first iPrefix bytes and whether those bytes end in a newline, if iPrefix > 0.
+    """
+    st = os.stat(sFile)
+    h = hashlib.sha1()
+    f = open(sFile, "rb")
+    sPrefixHash = None
+    bPrefixEndsNL = False
+    if (iPrefix > 0) and (iPrefix <= st.st_size):
+        prefix = f.read(iPrefix)
+        h.update(prefix)
+        sPrefixHash = h.hexdigest()
+        bPrefixEndsNL = prefix.endswith(b"\n")
+    while True:
+        data = f.read(1024*1024)
+        if len(data) == 0:
+            break
+        h.update(data)
+    f.close()
+    return { 'size': st.st_size, 'mtime': st.st_mtime, 'sha1': h.hexdigest() }, sPrefixHash, bPrefixEndsNL
+
+
+def import_csv_incremental(db, csvType, sFile, iBatchSize=4096):
+    """
+    Import only the transactions in the given csv file, which are not yet in the db.
+    * If the file is unchanged, since it was last imported, nothing is done.
+    * If data has only been appended to the file, the newly added lines are imported.
+    * Else the full file is read and the transactions already in the db are skipped.
+    db: a columnar db, which is updated in place.
+    Returns the number of transactions imported.
+    """
+    src = db['sources'].get(sFile)
+    st = os.stat(sFile)
+    if (src != None) and (src['size'] == st.st_size) and (src['mtime'] == st.st_mtime):
+        dprint("INFO:ADB.ImportCSVIncremental:{}:Unchanged".format(sFile), gDEBUGLVLINFO)
+        return 0
+    iPrefix = src['size'] if (src != None) else -1
+    fp, sPrefixHash, bPrefixEndsNL = _file_fingerprint(sFile, iPrefix)
+    if (src != None) and (fp['sha1'] == src['sha1']):
+        db['sources'][sFile].update(fp)
+        return 0
+    bAppended = (src != None) and (sPrefixHash == src['sha1']) and bPrefixEndsNL
+    iOffset = src['size'] if bAppended else 0
+    iRecords = src['records'] if bAppended else 0
+    iLastTime = src['lasttime'] if bAppended else 0
+    iNew = 0
+    tkeys = dict(_tkeys(db)) if not bAppended else None
+    seen = {}
+    def new_das():
+        nonlocal iNew, iRecords, iLastTime
+        for da in csv.iter_csv(csvType, sFile, iBatchSize, iOffset):
+            iRecords += len(da)
+            iLastTime = max(iLastTime, int(numpy.max(dates2epoch(da[:,IBS['TRANSDATE']]))))
+            if not bAppended:
+                da = _dedup_da(tkeys, da, seen)
+            iNew += len(da)
+            if len(da) > 0:
+                yield da
+    import_da_stream(db, new_das())
+    fp['records'] = iRecords
+    fp['lasttime'] = iLastTime
+    db['sources'][sFile] = fp
+    dprint("INFO:ADB.ImportCSVIncremental:{}:Appended={}:New={}".format(sFile, bAppended, iNew), gDEBUGLVLINFO)
+    return iNew
 
 
 def list_assetnames(db, bPrint=True):
     """
     Retrieve and optionally print the name of assets in the db.
-    db: the db containing the assets data.
+    db: the db containing the assets data, either a object array db or a columnar db.
     """
-    assetNames = numpy.unique(db[:,IDB['NAME']])
+    if type(db) == dict:
+        assetNames = numpy.sort(numpy.array(db['names'], dtype=object)[numpy.unique(db['NAME'])])
+    else:
+        assetNames = numpy.unique(db[:,IDB['NAME']])
     for i in range(len(assetNames)):
         an = assetNames[i]
         if (bPrint):
@@ -136,15 +811,69 @@ def list_assetnames(db, bPrint=True):
     return assetNames
 
 
-def _asset_summary_bsda(da):
-    daBuys = da[da[:,IBS['QTY']] > 0]
-    daSells = da[da[:,IBS['QTY']] < 0]
-    daSum = numpy.sum(da[:,IBS['TRANSVALUE']])
-    daBuysQty = numpy.sum(daBuys[:,IBS['QTY']])
-    daBuysAvg = numpy.sum((daBuys[:,IBS['PRICE']]*daBuys[:,IBS['QTY']])/daBuysQty)
-    daSellsQty = numpy.sum(daSells[:,IBS['QTY']])
-    daSellsAvg = numpy.sum((daSells[:,IBS['PRICE']]*daSells[:,IBS['QTY']])/daSellsQty)
-    return daSum, [daBuysAvg, daBuysQty], [daSellsAvg, daSellsQty]
+def _groupby(keys):
+    """
+    Group rows by the given int keys in one go.
+    Returns the order which brings the rows of each group together (retaining their
+    relative order), the start of each group in that order and the key of each group.
+    """
+    order = numpy.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+    if len(keys) == 0:
+        return order, numpy.zeros(0, dtype=numpy.int64), sortedKeys
+    starts = numpy.flatnonzero(numpy.concatenate(([True], sortedKeys[1:] != sortedKeys[:-1])))
+    return order, starts, sortedKeys[starts]
+
+
+def _group_sum(values, order, starts):
+    """
+    Sum the values of each group, with the groups as returned by _groupby.
+    """
+    if len(starts) == 0:
+        return numpy.zeros(0, dtype=values.dtype)
+    return numpy.add.reduceat(values[order], starts)
+
+
+def _group_rows(gs, i):
+    """
+    Return the rows belonging to the i-th group of the given group summary, in their original order.
+    """
+    return gs['order'][gs['starts'][i]:gs['ends'][i]]
+
+
+def _group_summary(keys, names, cols):
+    """
+    Sum the given dict of columns for each group of rows with the same key, in one pass.
+    Returns a dict with per group arrays of the sums, the group name and the
+    rows of each group (through order, starts, ends), with groups in name order.
+    """
+    order, starts, groupKeys = _groupby(keys)
+    gs = { 'order': order, 'starts': starts, 'ends': numpy.append(starts[1:], len(keys))[:len(starts)].astype(numpy.int64) }
+    gs['names'] = names[groupKeys]
+    for k in cols:
+        gs[k] = _group_sum(cols[k], order, starts)
+    nameOrder = numpy.argsort(gs['names'], kind='stable')
+    for k in gs:
+        if k != 'order':
+            gs[k] = gs[k][nameOrder]
+    return gs
+
+
+def assets_summary_bsda(da):
+    """
+    Summarise the transactions of each asset in the da in one pass.
+    Returns a dict of per asset arrays, with the assets in name order.
+    """
+    names, codes = numpy.unique(da[:,IBS['NAME']], return_inverse=True)
+    qty = da[:,IBS['QTY']].astype(numpy.int64)
+    buyValue = da[:,IBS['PRICE']].astype(numpy.float64)*qty
+    return _group_summary(codes.reshape(-1), names, {
+        'sum': da[:,IBS['TRANSVALUE']].astype(numpy.float64),
+        'buysQty': qty*(qty > 0),
+        'buysValue': numpy.where(qty > 0, buyValue, 0.0),
+        'sellsQty': qty*(qty < 0),
+        'sellsValue': numpy.where(qty < 0, buyValue, 0.0),
+        })
 
 
 def list_assets_bsda(da, filterAssets=[], bDetails=False):
@@ -155,92 +884,425 @@ def list_assets_bsda(da, filterAssets=[], bDetails=False):
     """
     totalSum = numpy.sum(da[:,IBS['TRANSVALUE']])
     totalQty = numpy.sum(da[:,IBS['QTY']])
-    assetsSummaryList = []
-    assetNames = list_assetnames(da, False)
-    print("GrandSummary: UniqAssetsCnt={:8}, NumOfAssets={:8}, TotalValue={:16.2f}".format(len(assetNames), totalQty, totalSum))
-    for an in assetNames:
-        if (len(filterAssets) > 0) and (not match_any(filterAssets, an)):
-            continue
-        assets = da[da[:,IBS['NAME']] == an]
-        assetSum, [ assetBuyAvg, assetBuyQty], [assetSellAvg, assetSellQty] = _asset_summary_bsda(assets)
-        if bDetails:
-            for s in assets:
+    gs = assets_summary_bsda(da)
+    buysAvg = div_or_zero(gs['buysValue'], gs['buysQty'])
+    sellsAvg = div_or_zero(gs['sellsValue'], gs['sellsQty'])
+    sHead = "GrandSummary: UniqAssetsCnt={:8}, NumOfAssets={:8}, TotalValue={:16.2f}\n".format(len(gs['names']), totalQty, totalSum)
+    bShow = match_any_names(filterAssets, gs['names'])
+    tbl = report.table([ 'name', 'buyAvg', 'buyQty', 'sellAvg', 'sellQty', 'sum' ],
+            [ gs['names'][bShow], buysAvg[bShow], gs['buysQty'][bShow], sellsAvg[bShow], gs['sellsQty'][bShow], gs['sum'][bShow] ])
+    sFormat = "{:48} : {:10.2f} x {:8} : {:10.2f} x {:8} : {:16.2f}"
+    lines = None
+    if bDetails:
+        lines = report.render_lines(tbl, sFormat)
+        for iLine, i in enumerate(numpy.flatnonzero(bShow)):
+            details = []
+            for s in da[_group_rows(gs, i)]:
                 t = s.copy()
                 t[IBS['TRANSDATE']] = t[IBS['TRANSDATE']].strftime("%Y%m%dIST%H%M")
-                print(t)
-        assetsSummaryList.append([ an, assetBuyAvg, assetBuyQty, assetSellAvg, assetSellQty, assetSum ])
-        print("{:48} : {:10.2f} x {:8} : {:10.2f} x {:8} : {:16.2f}".format(an, assetBuyAvg, assetBuyQty, assetSellAvg, assetSellQty, assetSum))
-        if gbSpaceOutListing:
-            print("")
-    return assetsSummaryList
+                details.append("{}\n".format(t))
+            lines[iLine] = "".join(details) + lines[iLine]
+    return report.emit(tbl, sFormat, sHead, "", "\n\n" if gbSpaceOutListing else "\n", lines)
+
+
+def _summary_avg(tSum, tQty, sWhat):
+    if (tQty == 0):
+        if (tSum == 0):
+            return 0
+        diag("SumWithoutQty", "WARN:DBASummary:{}Sum {} without {}Qty {}".format(sWhat, tSum, sWhat, tQty))
+        return numpy.nan
+    return tSum/tQty
+
+
+def _summary_avgs(tSums, tQtys, sWhat):
+    """
+    Return tSums/tQtys, handling zero qtys like _summary_avg.
+    """
+    avgs = div_or_zero(tSums, tQtys)
+    for i in numpy.flatnonzero((tQtys == 0) & (tSums != 0)):
+        avgs[i] = _summary_avg(tSums[i], tQtys[i], sWhat)
+    return avgs
 
 
 def _dba_summary(dba):
-    bSum = numpy.sum(dba[:,IDB['BTRANSVALUE']])
-    bQty = numpy.sum(dba[:,IDB['BQTY']])
-    if (bQty == 0):
-        if (bSum == 0):
-            bAvg = 0
-        else:
-            bAvg = numpy.nan
-            input("WARN:DBASummary:BuySum {} without BuyQty {}".format(bSum, bQty))
-    else:
-        bAvg = bSum/bQty
-    sSum = numpy.sum(dba[:,IDB['STRANSVALUE']])
-    sQty = numpy.sum(dba[:,IDB['SQTY']])
-    if (sQty == 0):
-        if (sSum == 0):
-            sAvg = 0
-        else:
-            sAvg = numpy.nan
-            input("WARN:DBASummary:SellSum {} without SellQty {}".format(sSum, sQty))
-    else:
-        sAvg = sSum/sQty
+    bSum = numpy.sum(dba_col(dba, 'BTRANSVALUE'))
+    bQty = numpy.sum(dba_col(dba, 'BQTY'))
+    bAvg = _summary_avg(bSum, bQty, "Buy")
+    sSum = numpy.sum(dba_col(dba, 'STRANSVALUE'))
+    sQty = numpy.sum(dba_col(dba, 'SQTY'))
+    sAvg = _summary_avg(sSum, sQty, "Sell")
     return [bAvg, bQty, bSum], [sAvg, sQty, sSum]
 
 
+def assets_summary(db):
+    """
+    Summarise each asset in the db, using the running per asset summaries of
+    the columnar db, which are built in one pass over the rows if required.
+    Returns a dict of per asset arrays, with the assets in name order, containing
+    the buy and sell qty and value of all (at) and in hand (ih) lots of each asset,
+    along with the realised profit/loss (pl) from its sold lots.
+    db: either a object array db or a columnar db.
+    """
+    cdb = db if (type(db) == dict) else cdb_from_db(db)
+    asum = _asum(cdb)
+    codes = numpy.array([ code for code in asum if asum[code][IASUM['atRows']] > 0 ], dtype=numpy.int64)
+    names = numpy.array(cdb['names'], dtype=object)[codes]
+    nameOrder = numpy.argsort(names, kind='stable')
+    gs = { 'codes': codes[nameOrder], 'names': names[nameOrder] }
+    values = [ asum[code] for code in gs['codes'].tolist() ]
+    for k in ASUMTYPES:
+        gs[k] = numpy.array([ v[IASUM[k]] for v in values ], dtype=ASUMTYPES[k])
+    return gs
+
+
+def merge_assets_summaries(gss):
+    """
+    Merge the assets summaries of many dbs into one, by summing the per asset
+    values of assets with the same name.
+    Returns a dict of per asset arrays like assets_summary (without the name codes),
+    with the assets in name order.
+    """
+    names = numpy.concatenate([ numpy.zeros(0, dtype=object) ] + [ gs['names'] for gs in gss ])
+    uNames, keys = numpy.unique(names, return_inverse=True)
+    cols = {}
+    for k in ASUMTYPES:
+        cols[k] = numpy.concatenate([ numpy.zeros(0, dtype=ASUMTYPES[k]) ] + [ gs[k] for gs in gss ])
+    gs = _group_summary(keys.reshape(-1).astype(numpy.int64), uNames, cols)
+    return dict([ (k, gs[k]) for k in [ 'names' ] + list(ASUMTYPES) ])
+
+
+LISTASSETSFORMAT ="{:48} :c: {:10.2f} x {:8} = {:16.2f} :b: {:10.2f} x {:8} :s: {:10.2f} x {:8} :PL: {:10.2f}"
+
+
+def _list_assets_details(dba, codes, lines):
+    """
+    Prepend the lots of each of the given assets (name codes) in the columnar db,
+    to the asset's line in the listing.
+    The rows of all the assets are grouped in one go, see _groupby.
+    """
+    order, starts, groupKeys = _groupby(dba['NAME'])
+    groups = { 'order': order, 'starts': starts, 'ends': numpy.append(starts[1:], len(order)).astype(numpy.int64) }
+    for iLine, code in enumerate(codes):
+        details = []
+        for s in cdb_to_db(cdb_filter(dba, _group_rows(groups, int(numpy.searchsorted(groupKeys, code))))):
+            t = s.copy()
+            if type(t[IDB['BTRANSDATE']]) == datetime.datetime:
+                t[IDB['BTRANSDATE']] = t[IDB['BTRANSDATE']].strftime("%Y%m%dIST%H%M")
+            else:
+                t[IDB['BTRANSDATE']] = '-NA-'
+            if type(t[IDB['STRANSDATE']]) == datetime.datetime:
+                t[IDB['STRANSDATE']] = t[IDB['STRANSDATE']].strftime("%Y%m%dIST%H%M")
+            else:
+                t[IDB['STRANSDATE']] = '-NA-'
+            details.append("{0[0]:48} :b: {0[1]:16} {0[2]:10.2f} {0[3]:8} {0[4]:16.2f} :s: {0[5]:16} {0[6]:10.2f} {0[7]:8} {0[8]:16.2f}\n".format(t))
+        lines[iLine] = "".join(details) + lines[iLine]
+
+
+def list_assets_gs(gs, bShow, ihTotals, dba=None):
+    """
+    Output the listing of the shown assets of the given assets summary, between
+    the in hand grand summary lines.
+    ihTotals: the count of in hand assets, their total qty and invested value.
+    dba: the columnar db whose lots should be listed along with each asset, if any.
+    """
+    sHead = "GrandSummary:InHand: UniqAssets={:8}, TotalQtys={:8}, TotalInvestedValue={:16.2f}\n".format(*ihTotals)
+    totalProfitLoss = sum(gs['pl'][bShow].tolist())
+    atBAvg = _summary_avgs(gs['atBSum'][bShow], gs['atBQty'][bShow], "Buy")
+    atSAvg = _summary_avgs(gs['atSSum'][bShow], gs['atSQty'][bShow], "Sell")
+    ihBAvg = _summary_avgs(gs['ihBSum'][bShow], gs['ihBQty'][bShow], "Buy")
+    tbl = report.table([ 'name', 'ihBAvg', 'ihBQty', 'ihBSum', 'atBAvg', 'atBQty', 'atSAvg', 'atSQty', 'pl' ],
+            [ gs['names'][bShow], ihBAvg, gs['ihBQty'][bShow], gs['ihBSum'][bShow], atBAvg, gs['atBQty'][bShow], atSAvg, gs['atSQty'][bShow], gs['pl'][bShow] ])
+    lines = None
+    if type(dba) != type(None):
+        lines = report.render_lines(tbl, LISTASSETSFORMAT)
+        _list_assets_details(dba, [ dba['namecodes'][an] for an in gs['names'][bShow].tolist() ], lines)
+    sTail = "GrandSummary:InHand: UniqAssets={:8}, TotalQtys={:8}, TotalInvestedValue={:16.2f} :ProfitLoss:{:16.2f}\n".format(*ihTotals, totalProfitLoss)
+    return report.emit(tbl, LISTASSETSFORMAT, sHead, sTail, "\n\n" if gbSpaceOutListing else "\n", lines)
+
+
 def list_assets(db, filterAssets=[], bDetails=False):
     """
     List the data about specified assets in the db.
-    db: the db containing data about assets
+    db: the db containing data about assets, either a object array db or a columnar db.
     filterAssets: a list of asset names or empty list.
     """
-    dba = db
-    dbaInHand = dba[dba[:,IDB['SQTY']] == 0]
-    atAssetNames = list_assetnames(dba, False)
-    ihAssetNames = list_assetnames(dbaInHand, False)
-    ihUniqAssetsCnt = len(ihAssetNames)
-    [ihTBAvg, ihTBQty, ihTBSum], [ihTSAvg, ihTSQty, ihTSSum] = _dba_summary(dbaInHand)  # In hand totals
-    print("GrandSummary:InHand: UniqAssets={:8}, TotalQtys={:8}, TotalInvestedValue={:16.2f}".format(ihUniqAssetsCnt, ihTBQty, ihTBSum))
-    assetsSummaryList = []
-    totalProfitLoss = 0
-    for an in atAssetNames:
-        if (len(filterAssets) > 0) and (not match_any(filterAssets, an)):
+    dba = db if (type(db) == dict) else cdb_from_db(db)
+    gs = assets_summary(dba)
+    ihTotals = (numpy.count_nonzero(gs['ihRows']), numpy.sum(gs['ihBQty']), numpy.sum(gs['ihBSum']))    # In hand totals
+    return list_assets_gs(gs, match_any_names(filterAssets, gs['names']), ihTotals, dba if bDetails else None)
+
+
+def mark_to_market(db, daPrices, iSymbol=kite.IHOLDINGS['SYMBOL'], iPrice=kite.IHOLDINGS['LTP'], tNow=None):
+    """
+    Value the in hand lots of the db at the given prices, in one pass.
+    db: either a object array db or a columnar db.
+    daPrices: a 2D array containing a symbol and a price column, like the da of KiteHoldings.
+    iSymbol, iPrice: the index of the symbol and price columns in daPrices.
+    tNow: the datetime to calculate holding periods upto, defaults to now.
+    Returns the per lot values and the per asset values (in name order), as dicts of arrays.
+    Lots of assets without a price get a nan price.
+    """
+    cdb = db if (type(db) == dict) else cdb_from_db(db)
+    tNow = datetime.datetime.now() if (type(tNow) == type(None)) else tNow
+    prices = numpy.full(len(cdb['names']), numpy.nan)
+    codes = numpy.array([ cdb['namecodes'].get(sym, -1) for sym in daPrices[:,iSymbol] ], dtype=numpy.int64)
+    bKnown = (codes >= 0)
+    prices[codes[bKnown]] = daPrices[bKnown,iPrice].astype(numpy.float64)
+    rows = numpy.flatnonzero((cdb['SQTY'] == 0) & (cdb['BQTY'] > 0))
+    lots = { 'rows': rows, 'codes': cdb['NAME'][rows] }
+    lots['names'] = numpy.array(cdb['names'], dtype=object)[lots['codes']]
+    lots['qty'] = cdb['BQTY'][rows]
+    lots['invested'] = cdb['BTRANSVALUE'][rows]
+    lots['price'] = prices[lots['codes']]
+    lots['value'] = lots['price']*lots['qty']
+    lots['pl'] = lots['value'] - lots['invested']
+    lots['retPct'] = div_or_zero(lots['pl']*100, lots['invested'])
+    lots['holdDays'] = (date2epoch(tNow) - cdb['BTRANSDATE'][rows])/86400
+    gs = _group_summary(lots['codes'], numpy.array(cdb['names'], dtype=object), {
+        'qty': lots['qty'],
+        'invested': lots['invested'],
+        'value': lots['value'],
+        'pl': lots['pl'],
+        'investedDays': lots['invested']*lots['holdDays'],
+        })
+    gs['price'] = div_or_zero(gs['value'], gs['qty'])
+    gs['avgPrice'] = div_or_zero(gs['invested'], gs['qty'])
+    gs['retPct'] = div_or_zero(gs['pl']*100, gs['invested'])
+    gs['holdDays'] = div_or_zero(gs['investedDays'], gs['invested'])
+    gs['annRetPct'] = div_or_zero(gs['retPct']*365, gs['holdDays'])
+    return lots, gs
+
+
+def reconcile_holdings(db, daHoldings, avgPriceTolerance=0.01):
+    """
+    Compare the in hand qty and average buy price of each asset in the db,
+    with those in the given KiteHoldings da.
+    avgPriceTolerance: the relative difference in average price to allow.
+    Returns a dict of arrays, with a entry for each asset which doesnt match,
+    along with the reason for the mismatch.
+    """
+    gs = assets_summary(db)
+    dbQty = dict(zip(gs['names'].tolist(), gs['ihBQty'].tolist()))
+    dbAvg = dict(zip(gs['names'].tolist(), div_or_zero(gs['ihBSum'], gs['ihBQty']).tolist()))
+    khQty = dict(zip(daHoldings[:,kite.IHOLDINGS['SYMBOL']].tolist(), daHoldings[:,kite.IHOLDINGS['QTY']].tolist()))
+    khAvg = dict(zip(daHoldings[:,kite.IHOLDINGS['SYMBOL']].tolist(), daHoldings[:,kite.IHOLDINGS['AVGPRICE']].tolist()))
+    mismatches = []
+    for an in sorted(set(khQty) | set([ an for an in dbQty if dbQty[an] != 0 ])):
+        if an not in dbQty:
+            sReason = "NotInDB"
+        elif an not in khQty:
+            sReason = "NotInHoldings"
+        elif dbQty[an] != khQty[an]:
+            sReason = "QtyMismatch"
+        elif abs(dbAvg[an] - khAvg[an]) > abs(khAvg[an]*avgPriceTolerance):
+            sReason = "AvgPriceMismatch"
+        else:
             continue
-        atAssets = dba[dba[:,IDB['NAME']] == an]                # All total of a asset
-        ihAssets = dbaInHand[dbaInHand[:,IDB['NAME']] == an]    # In hand of a asset
-        prevAssets = atAssets[atAssets[:,IDB['SQTY']] > 0]
-        curAssetProfitLoss = numpy.sum(prevAssets[:,IDB['STRANSVALUE']] - prevAssets[:,IDB['BTRANSVALUE']])
-        totalProfitLoss += curAssetProfitLoss
-        [atBAvg, atBQty, atBSum], [atSAvg, atSQty, atSSum] = _dba_summary(atAssets)
-        [ihBAvg, ihBQty, ihBSum], [ihSAvg, ihSQty, ihSSum] = _dba_summary(ihAssets)
-        if bDetails:
-            for s in atAssets:
-                t = s.copy()
-                if type(t[IDB['BTRANSDATE']]) == datetime.datetime:
-                    t[IDB['BTRANSDATE']] = t[IDB['BTRANSDATE']].strftime("%Y%m%dIST%H%M")
-                else:
-                    t[IDB['BTRANSDATE']] = '-NA-'
-                if type(t[IDB['STRANSDATE']]) == datetime.datetime:
-                    t[IDB['STRANSDATE']] = t[IDB['STRANSDATE']].strftime("%Y%m%dIST%H%M")
-                else:
-                    t[IDB['STRANSDATE']] = '-NA-'
-                print("{0[0]:48} :b: {0[1]:16} {0[2]:10.2f} {0[3]:8} {0[4]:16.2f} :s: {0[5]:16} {0[6]:10.2f} {0[7]:8} {0[8]:16.2f}".format(t))
-        assetsSummaryList.append([ an, ihBAvg, ihBQty, ihBSum, atBAvg, atBQty, atSAvg, atSQty, curAssetProfitLoss ])
-        print("{:48} :c: {:10.2f} x {:8} = {:16.2f} :b: {:10.2f} x {:8} :s: {:10.2f} x {:8} :PL: {:10.2f}".format(an, ihBAvg, ihBQty, ihBSum, atBAvg, atBQty, atSAvg, atSQty, curAssetProfitLoss))
-        if gbSpaceOutListing:
-            print("")
-    print("GrandSummary:InHand: UniqAssets={:8}, TotalQtys={:8}, TotalInvestedValue={:16.2f} :ProfitLoss:{:16.2f}".format(ihUniqAssetsCnt, ihTBQty, ihTBSum, totalProfitLoss))
-    return assetsSummaryList
+        mismatches.append([ an, khQty.get(an, 0), dbQty.get(an, 0), khAvg.get(an, 0.0), dbAvg.get(an, 0.0), sReason ])
+    rec = {}
+    for i, k in enumerate([ 'names', 'kiteQty', 'dbQty', 'kiteAvg', 'dbAvg', 'reason' ]):
+        rec[k] = numpy.array([ m[i] for m in mismatches ], dtype=object if k in [ 'names', 'reason' ] else None)
+    return rec
+
+
+def list_mark_to_market(db, daHoldings, filterAssets=[], bReconcile=True):
+    """
+    List the unrealised profit/loss of the in hand assets in the db, valued at
+    the LTP in the given KiteHoldings da, along with any mismatches between the
+    holdings and the db.
+    """
+    lots, gs = mark_to_market(db, daHoldings)
+    bShow = match_any_names(filterAssets, gs['names'])
+    tbl = report.table([ 'name', 'qty', 'avgPrice', 'price', 'invested', 'value', 'pl', 'retPct', 'holdDays' ],
+            [ gs['names'][bShow] ] + [ gs[k][bShow] for k in [ 'qty', 'avgPrice', 'price', 'invested', 'value', 'pl', 'retPct', 'holdDays' ] ])
+    sTail = "GrandSummary:MTM: Invested={:16.2f}, Value={:16.2f}, UnrealisedPL={:16.2f}\n".format(numpy.sum(gs['invested']), numpy.nansum(gs['value']), numpy.nansum(gs['pl']))
+    if bReconcile:
+        rec = reconcile_holdings(db, daHoldings)
+        for i in range(len(rec['names'])):
+            sTail += "WARN:MTM:{}:{}: Kite {} x {:.2f}, DB {} x {:.2f}\n".format(rec['reason'][i], rec['names'][i], rec['kiteQty'][i], rec['kiteAvg'][i], rec['dbQty'][i], rec['dbAvg'][i])
+    sFormat = "{:48} : {:8} x {:10.2f} -> {:10.2f} : {:16.2f} -> {:16.2f} :UPL: {:12.2f} {:8.2f}% :Days: {:8.1f}"
+    return report.emit(tbl, sFormat, "", sTail, "\n\n" if gbSpaceOutListing else "\n")
+
+
+TIDXCHECKPOINTEVERY = 4096
+
+
+def time_index(db, iCheckpointEvery=TIDXCHECKPOINTEVERY):
+    """
+    Build a time index over the db, to answer point in time queries without
+    replaying the transactions.
+    Each buy contributes a event at BTRANSDATE and each sold lot a event at
+    STRANSDATE, which are kept sorted by time, along with the per asset
+    qty, invested and realised values (by name code) after every
+    iCheckpointEvery events.
+    db: either a object array db or a columnar db.
+    """
+    cdb = db if (type(db) == dict) else cdb_from_db(db)
+    bRows = numpy.flatnonzero(cdb['BQTY'] > 0)
+    sRows = numpy.flatnonzero(cdb['SQTY'] > 0)
+    sBValue = cdb['BTRANSVALUE'][sRows]*(cdb['SQTY'][sRows]/cdb['BQTY'][sRows])
+    times = numpy.concatenate([ cdb['BTRANSDATE'][bRows], cdb['STRANSDATE'][sRows] ])
+    order = numpy.argsort(times, kind='stable')
+    tidx = {
+        'names': numpy.array(cdb['names'], dtype=object),
+        'times': times[order],
+        'codes': numpy.concatenate([ cdb['NAME'][bRows], cdb['NAME'][sRows] ])[order],
+        'qty': numpy.concatenate([ cdb['BQTY'][bRows], -cdb['SQTY'][sRows] ])[order],
+        'invested': numpy.concatenate([ cdb['BTRANSVALUE'][bRows], -sBValue ])[order],
+        'realised': numpy.concatenate([ numpy.zeros(len(bRows)), cdb['STRANSVALUE'][sRows] - sBValue ])[order],
+        'every': iCheckpointEvery,
+        }
+    iAssets = len(tidx['names'])
+    state = numpy.zeros((3, iAssets))
+    checkpoints = [ state.copy() ]
+    for iStart in range(0, len(times), iCheckpointEvery):
+        state += _tidx_apply(tidx, iStart, iStart+iCheckpointEvery)
+        checkpoints.append(state.copy())
+    tidx['checkpoints'] = numpy.array(checkpoints)
+    return tidx
+
+
+def _tidx_apply(tidx, iStart, iEnd):
+    """
+    Return the per asset qty, invested and realised change due to the events in [iStart, iEnd).
+    """
+    codes = tidx['codes'][iStart:iEnd]
+    iAssets = len(tidx['names'])
+    return numpy.array([ numpy.bincount(codes, weights=tidx[k][iStart:iEnd], minlength=iAssets) for k in [ 'qty', 'invested', 'realised' ] ])
+
+
+def _tidx_result(tidx, state):
+    nameOrder = numpy.argsort(tidx['names'], kind='stable')
+    return {
+        'names': tidx['names'][nameOrder],
+        'qty': numpy.rint(state[0][nameOrder]).astype(numpy.int64),
+        'invested': state[1][nameOrder],
+        'realised': state[2][nameOrder],
+        }
+
+
+def positions_asof(db, tAt, tidx=None):
+    """
+    Return the in hand qty, invested value and realised profit/loss of each
+    asset (in name order), as they stood at the given time (inclusive).
+    tAt: a datetime or epoch seconds.
+    tidx: a time index of the db, built if not given.
+    """
+    tidx = time_index(db) if (type(tidx) == type(None)) else tidx
+    n = int(numpy.searchsorted(tidx['times'], date2epoch(tAt), side='right'))
+    iCheckpoint = n // tidx['every']
+    state = tidx['checkpoints'][iCheckpoint] + _tidx_apply(tidx, iCheckpoint*tidx['every'], n)
+    return _tidx_result(tidx, state)
 
 
+def positions_series(db, tStart, tEnd, tidx=None):
+    """
+    Return a daily series of the per asset positions, as they stood at the end
+    of each day in [tStart, tEnd].
+    Returns a dict with the days and the qty, invested and realised values as
+    2D arrays of days x assets (in name order).
+    tidx: a time index of the db, built if not given.
+    """
+    tidx = time_index(db) if (type(tidx) == type(None)) else tidx
+    days = numpy.arange(numpy.datetime64(tStart, 'D'), numpy.datetime64(tEnd, 'D') + 1)
+    dayEnds = (days + 1).astype('datetime64[s]').astype(numpy.int64) - 1
+    res = positions_asof(db, int(dayEnds[0]), tidx) if (len(days) > 0) else _tidx_result(tidx, numpy.zeros((3, len(tidx['names']))))
+    iStart = int(numpy.searchsorted(tidx['times'], dayEnds[0], side='right')) if (len(days) > 0) else 0
+    iEnd = int(numpy.searchsorted(tidx['times'], dayEnds[-1], side='right')) if (len(days) > 0) else 0
+    dayIdx = numpy.searchsorted(dayEnds, tidx['times'][iStart:iEnd], side='left')
+    nameOrder = numpy.argsort(tidx['names'], kind='stable')
+    codePos = numpy.empty(len(nameOrder), dtype=numpy.int64)
+    codePos[nameOrder] = numpy.arange(len(nameOrder))
+    series = { 'names': res['names'], 'days': days }
+    for k in [ 'qty', 'invested', 'realised' ]:
+        deltas = numpy.zeros((len(days), len(nameOrder)))
+        numpy.add.at(deltas, (dayIdx, codePos[tidx['codes'][iStart:iEnd]]), tidx[k][iStart:iEnd])
+        series[k] = res[k] + numpy.cumsum(deltas, axis=0)
+    series['qty'] = numpy.rint(series['qty']).astype(numpy.int64)
+    return series
+
+
+GAINSLONGTERMDAYS = 365
+GAINSFYSTARTMONTH = 4
+
+
+def _financial_years(epochs, iFYStartMonth=GAINSFYSTARTMONTH):
+    """
+    Return the financial year (identified by the calendar year in which it starts)
+    of each of the given epoch seconds.
+    """
+    months = epochs.astype('datetime64[s]').astype('datetime64[M]').astype(numpy.int64)
+    return (months - (iFYStartMonth - 1)) // 12 + 1970
+
+
+def realised_gains(db, iLongTermDays=GAINSLONGTERMDAYS, assetsLongTermDays={}, iFYStartMonth=GAINSFYSTARTMONTH):
+    """
+    Compute the holding period and gain of each sold lot in the db, classifying
+    it as a long term gain if held for more than the long term days threshold.
+    iLongTermDays: the default long term threshold in days.
+    assetsLongTermDays: a dict of asset name to long term threshold, for assets which differ.
+    iFYStartMonth: the month in which the financial year starts.
+    Returns a typed array with one entry per sold lot, in db order, and a typed
+    array with the gains summed per asset, financial year and term.
+    """
+    cdb = db if (type(db) == dict) else cdb_from_db(db)
+    rows = numpy.flatnonzero(cdb['SQTY'] > 0)
+    codes = cdb['NAME'][rows]
+    thresholds = numpy.full(len(cdb['names']), iLongTermDays, dtype=numpy.int64)
+    for an in assetsLongTermDays:
+        if an in cdb['namecodes']:
+            thresholds[cdb['namecodes'][an]] = assetsLongTermDays[an]
+    bBValue = cdb['BTRANSVALUE'][rows]*(cdb['SQTY'][rows]/cdb['BQTY'][rows])
+    names = numpy.array(cdb['names'], dtype=str) if (len(cdb['names']) > 0) else numpy.zeros(0, dtype=str)
+    lots = numpy.zeros(len(rows), dtype=[
+        ('name', names.dtype), ('bDate', 'datetime64[s]'), ('sDate', 'datetime64[s]'),
+        ('qty', numpy.int64), ('bValue', numpy.float64), ('sValue', numpy.float64),
+        ('gain', numpy.float64), ('holdDays', numpy.int64), ('longTerm', numpy.bool_), ('fy', numpy.int64),
+        ])
+    lots['name'] = names[codes]
+    lots['bDate'] = cdb['BTRANSDATE'][rows]
+    lots['sDate'] = cdb['STRANSDATE'][rows]
+    lots['qty'] = cdb['SQTY'][rows]
+    lots['bValue'] = bBValue
+    lots['sValue'] = cdb['STRANSVALUE'][rows]
+    lots['gain'] = lots['sValue'] - bBValue
+    lots['holdDays'] = (cdb['STRANSDATE'][rows] - cdb['BTRANSDATE'][rows]) // 86400
+    lots['longTerm'] = lots['holdDays'] > thresholds[codes]
+    lots['fy'] = _financial_years(cdb['STRANSDATE'][rows], iFYStartMonth)
+    fyMin = lots['fy'].min() if (len(rows) > 0) else 0
+    keys = ((lots['fy'] - fyMin)*len(names) + codes)*2 + lots['longTerm']
+    order, starts, groupKeys = _groupby(keys)
+    gains = numpy.zeros(len(starts), dtype=[
+        ('name', names.dtype), ('fy', numpy.int64), ('longTerm', numpy.bool_), ('lots', numpy.int64),
+        ('qty', numpy.int64), ('bValue', numpy.float64), ('sValue', numpy.float64), ('gain', numpy.float64),
+        ])
+    gains['name'] = names[(groupKeys // 2) % max(len(names), 1)]
+    gains['fy'] = groupKeys // 2 // max(len(names), 1) + fyMin
+    gains['longTerm'] = groupKeys % 2
+    gains['lots'] = numpy.diff(numpy.append(starts, len(keys)))
+    for k in [ 'qty', 'bValue', 'sValue', 'gain' ]:
+        gains[k] = _group_sum(lots[k], order, starts)
+    return lots, numpy.sort(gains, order=['fy', 'name', 'longTerm'], kind='stable')
+
+
+def list_realised_gains(db, filterAssets=[], iLongTermDays=GAINSLONGTERMDAYS, assetsLongTermDays={}, iFYStartMonth=GAINSFYSTARTMONTH):
+    """
+    List the short and long term realised gains of the assets in the db, per financial year.
+    Returns the table of the listed gains.
+    """
+    lots, gains = realised_gains(db, iLongTermDays, assetsLongTermDays, iFYStartMonth)
+    if len(filterAssets) > 0:
+        gains = gains[match_any_names(filterAssets, gains['name'])]
+    fys, fyIdx = numpy.unique(gains['fy'], return_inverse=True)
+    fyNames = numpy.array([ "FY{}-{:02}".format(fy, (fy+1)%100) for fy in fys.tolist() ], dtype=str)
+    tbl = report.table([ 'fy', 'term', 'name', 'lots', 'qty', 'bValue', 'sValue', 'gain' ],
+            [ fyNames[fyIdx.reshape(-1)], numpy.where(gains['longTerm'], "LT", "ST") ] + [ gains[k] for k in [ 'name', 'lots', 'qty', 'bValue', 'sValue', 'gain' ] ])
+    sFormat = "{}:{}: {:48} : {:8} lots, {:8} qty : {:16.2f} -> {:16.2f} : {:16.2f}"
+    lines = report.render_lines(tbl, sFormat)
+    iEnds = numpy.append(numpy.flatnonzero(gains['fy'][1:] != gains['fy'][:-1]), len(gains)-1) if (len(gains) > 0) else []
+    for i, iEnd in enumerate(iEnds):
+        fyGains = gains[gains['fy'] == fys[i]]
+        lines[iEnd] += "\n{}:Summary: ShortTerm={:16.2f}, LongTerm={:16.2f}".format(fyNames[i], numpy.sum(fyGains['gain'][~fyGains['longTerm']]), numpy.sum(fyGains['gain'][fyGains['longTerm']]))
+        if gbSpaceOutListing:
+            lines[iEnd] += "\n"
+    return report.emit(tbl, sFormat, "", "", "\n", lines)
@@ -4,36 +4,74 @@
 # GPL
 
 
+import time
+gStartupTimes = [ [ "Start", time.perf_counter() ] ]
 import sys
 import os
-import time
-import numpy
-import readline
-import rlcompleter
 import traceback
 
 from hlpr import *
-import csv
-import generic
-import kite
-import h7
-import adb
+numpy = lazy_import('numpy')
+csv = lazy_import('csv')
+generic = lazy_import('generic')
+kite = lazy_import('kite')
+h7 = lazy_import('h7')
+adb = lazy_import('adb')
 
 
 HISTORYFILE="./.assetsdb.history"
 
 
+def startup_phase(sPhase):
+    """
+    Note the time at which the given startup phase got over.
+    """
+    gStartupTimes.append([ sPhase, time.perf_counter() ])
+
+
+def startup_report():
+    """
+    Print the time taken by each startup phase.
+    """
+    for i in range(1, len(gStartupTimes)):
+        print("INFO:Startup:{:16}: {:8.2f} ms".format(gStartupTimes[i][0], (gStartupTimes[i][1] - gStartupTimes[i-1][1])*1000))
+    print("INFO:Startup:{:16}: {:8.2f} ms".format("Total", (gStartupTimes[-1][1] - gStartupTimes[0][1])*1000))
+
+
 def startup_message():
     print("INFO: AssetsDB")
     print("NOTE: exit() to quit")
 
 
 def startup():
-    csv.init()
+    """
+    Setup the interactive session. The csvTypes are registered on their 1st use
+    and the modules on which AssetsDB depends are loaded when they are 1st used.
+    """
+    global readline
+    import readline
+    import rlcompleter
     readline.parse_and_bind("tab: complete")
+    startup_phase("Readline")
     startup_message()
 
 
+def stats(sCmd="dump"):
+    """
+    Control the import and matching instrumentation.
+    sCmd: on (enable the timers), off, reset or dump (print the counters and timers).
+    Use stats_profile(func, args...) to capture a cProfile of a operation.
+    """
+    if sCmd == "on":
+        stats_enable(True)
+    elif sCmd == "off":
+        stats_enable(False)
+    elif sCmd == "reset":
+        stats_reset()
+    else:
+        stats_dump()
+
+
 def load_history(histFile):
     if os.path.exists(histFile):
         readline.read_history_file(histFile)
@@ -87,12 +125,21 @@ def _runme():
 
 
 def runme():
-    init_scripts(sys.argv[1:])
+    bTimings = ("--timings" in sys.argv)
+    init_scripts([ x for x in sys.argv[1:] if x != "--timings" ])
+    startup_phase("Scripts")
     load_history(HISTORYFILE)
+    startup_phase("History")
+    if bTimings:
+        startup_report()
     _runme()
     save_history(HISTORYFILE)
 
 
+startup_phase("Imports")
+if (len(sys.argv) > 1) and (sys.argv[1] == "--batch"):
+    import batch
+    sys.exit(batch.main(sys.argv[2:]))
 startup()
 runme()
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+# batch - Run AssetsDB pipelines non interactively
+# HanishKVC, 2021
+# GPL
+#
+# A pipeline is a json file like
+# {
+#   "diagPolicy": "collect",
+#   "stats": true,
+#   "stages": [
+#     { "op": "load", "path": "store/db" },
+#     { "op": "import", "files": [ [ "KiteTrades", "trades.csv" ], [ "KiteHoldings", "holdings.csv" ] ], "workers": 2, "profile": "import.prof" },
+#     { "op": "match" },
+#     { "op": "incremental", "csvType": "KiteTrades", "file": "trades-live.csv" },
+#     { "op": "save", "path": "store/db" },
+#     { "op": "report", "what": "assets", "format": "csv", "out": "assets.csv" },
+#     { "op": "report", "what": "diags", "format": "json", "out": "-" }
+#   ]
+# }
+#
+# stats: print the instrumentation counters and timers to stderr at the end.
+# profile: capture a cProfile of the stage into the given file.
+#
+
+
+import argparse
+import contextlib
+import json
+import sys
+import time
+import traceback
+import numpy
+
+from hlpr import *
+import csv
+import adb
+import report
+
+
+EXITOK = 0
+EXITFAILED = 1
+EXITBADPIPELINE = 2
+EXITANOMALIES = 3
+
+MATCHCSVTYPES = [ 'KiteTrades', 'H7O1' ]
+HOLDINGSCSVTYPE = 'KiteHoldings'
+
+
+def _das_of(state, csvTypes):
+    return [ da for csvType, da in state['das'] if csvType in csvTypes ]
+
+
+def _stage_load(state, stage):
+    state['db'] = adb.load_db(stage['path'], stage.get('mmap', True))
+
+
+def _stage_import(state, stage):
+    files = [ tuple(f) for f in stage['files'] ]
+    if len(files) == 1:
+        das = [ csv.import_csv(*files[0]) ]
+    else:
+        das = csv.import_csvs(files, stage.get('workers'))
+    for (csvType, sFile), da in zip(files, das):
+        if (type(da) != type(None)):
+            state['das'].append((csvType, da))
+
+
+def _stage_match(state, stage):
+    das = _das_of(state, stage.get('types', MATCHCSVTYPES))
+    if type(state['db']) == type(None):
+        state['db'] = adb.cdb_new()
+    if len(das) > 0:
+        adb.import_da(state['db'], adb.merge_das(das))
+    state['das'] = [ x for x in state['das'] if x[0] not in stage.get('types', MATCHCSVTYPES) ]
+
+
+def _stage_incremental(state, stage):
+    if type(state['db']) == type(None):
+        state['db'] = adb.cdb_new()
+    adb.import_csv_incremental(state['db'], stage['csvType'], stage['file'], stage.get('batchSize', 4096))
+
+
+def _stage_save(state, stage):
+    adb.save_db(state['db'], stage['path'])
+
+
+def _report_assets(state, stage):
+    gs = adb.assets_summary(state['db'])
+    del(gs['codes'])
+    return gs
+
+
+def _report_gains(state, stage):
+    lots, gains = adb.realised_gains(state['db'], stage.get('longTermDays', adb.GAINSLONGTERMDAYS), stage.get('assetsLongTermDays', {}), stage.get('fyStartMonth', adb.GAINSFYSTARTMONTH))
+    return lots if stage.get('lots', False) else gains
+
+
+def _report_mtm(state, stage):
+    das = _das_of(state, [ HOLDINGSCSVTYPE ])
+    if len(das) == 0:
+        raise ValueError("Batch:Report:mtm needs a imported {} file".format(HOLDINGSCSVTYPE))
+    lots, gs = adb.mark_to_market(state['db'], das[-1])
+    return lots if stage.get('lots', False) else gs
+
+
+def _report_positions(state, stage):
+    return adb.positions_asof(state['db'], numpy.datetime64(stage['at'], 's'))
+
+
+def _report_diags(state, stage):
+    return diag_report()
+
+
+Reports = {
+    'assets': _report_assets,
+    'gains': _report_gains,
+    'mtm': _report_mtm,
+    'positions': _report_positions,
+    'diags': _report_diags,
+    }
+
+
+def _stage_report(state, stage):
+    res = Reports[stage['what']](state, stage)
+    report.write_report(res, stage.get('format', 'json'), stage.get('out', '-'))
+
+
+Stages = {
+    'load': _stage_load,
+    'import': _stage_import,
+    'match': _stage_match,
+    'incremental': _stage_incremental,
+    'save': _stage_save,
+    'report': _stage_report,
+    }
+
+
+def check_pipeline(pipeline):
+    """
+    Check the given pipeline, returning a list of the problems found in it.
+    """
+    problems = []
+    if pipeline.get('diagPolicy', 'collect') not in DIAGPOLICIES:
+        problems.append("diagPolicy should be one of {}".format(DIAGPOLICIES))
+    for i, stage in enumerate(pipeline.get('stages', [])):
+        if stage.get('op') not in Stages:
+            problems.append("stage {}: unknown op {}".format(i, stage.get('op')))
+        elif (stage['op'] == 'report') and (stage.get('what') not in Reports):
+            problems.append("stage {}: unknown report {}".format(i, stage.get('what')))
+    return problems
+
+
+def run_pipeline(pipeline, bTimings=True):
+    """
+    Run the stages of the given pipeline in order, stopping at the first stage which fails.
+    Diagnostics default to the collect policy, as there is no user to prompt.
+    The time taken by each stage is printed to stderr.
+    Returns the exit code and the final state.
+    """
+    problems = check_pipeline(pipeline)
+    if len(problems) > 0:
+        for sProblem in problems:
+            sys.stderr.write("ERRR:Batch:Pipeline:{}\n".format(sProblem))
+        return EXITBADPIPELINE, None
+    csv.init()
+    diag_policy(pipeline.get('diagPolicy', 'collect'))
+    diag_report(True)
+    stats_reset()
+    stats_enable(pipeline.get('stats', False))
+    state = { 'db': None, 'das': [] }
+    tStart = time.perf_counter()
+    iExit = EXITOK
+    for i, stage in enumerate(pipeline.get('stages', [])):
+        tStageStart = time.perf_counter()
+        try:
+            if 'profile' in stage:
+                with contextlib.redirect_stdout(sys.stderr):
+                    stats_profile(Stages[stage['op']], state, stage, sFile=stage['profile'])
+            else:
+                Stages[stage['op']](state, stage)
+        except:
+            traceback.print_exc()
+            sys.stderr.write("ERRR:Batch:Stage:{}:{}: failed\n".format(i, stage['op']))
+            iExit = EXITFAILED
+            break
+        finally:
+            if bTimings:
+                sys.stderr.write("INFO:Batch:Stage:{}:{}: {:.3f}s\n".format(i, stage['op'], time.perf_counter() - tStageStart))
+    if bTimings:
+        sys.stderr.write("INFO:Batch:Total: {:.3f}s\n".format(time.perf_counter() - tStart))
+    if pipeline.get('stats', False):
+        with contextlib.redirect_stdout(sys.stderr):
+            stats_dump()
+    if (iExit == EXITOK) and (len(diag_report()) > 0):
+        sys.stderr.write("WARN:Batch:{} anomalies\n".format(len(diag_report())))
+        iExit = EXITANOMALIES
+    return iExit, state
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Run a AssetsDB pipeline non interactively")
+    parser.add_argument("pipeline", help="the json file containing the pipeline")
+    parser.add_argument("--diag", default=None, choices=DIAGPOLICIES, help="override the diagnostics policy of the pipeline")
+    parser.add_argument("--notimings", action="store_true", help="dont print the time taken by each stage")
+    args = parser.parse_args(args)
+    try:
+        f = open(args.pipeline)
+        pipeline = json.load(f)
+        f.close()
+    except:
+        traceback.print_exc()
+        return EXITBADPIPELINE
+    if args.diag != None:
+        pipeline['diagPolicy'] = args.diag
+    iExit, state = run_pipeline(pipeline, not args.notimings)
+    return iExit
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
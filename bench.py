@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# bench - Benchmark the import, matching and listing hot paths
+# HanishKVC, 2021
+# GPL
+#
+
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy
+
+import hlpr
+import csv
+import adb
+import kite
+
+
+#
+# Synthetic data generators
+#
+def _symbols(iSymbols):
+    return [ "SYM{:05}".format(i) for i in range(iSymbols) ]
+
+
+def gen_kite_trades(sFile, iTrades, iSymbols, iSeed=1, sellFraction=0.4):
+    """
+    Generate a KiteTrades csv file with iTrades trades over iSymbols symbols,
+    where sells never exceed the quantity held at that time.
+    """
+    r = random.Random(iSeed)
+    symbols = _symbols(iSymbols)
+    held = {}
+    t = datetime.datetime(2015, 1, 1, 9, 15)
+    f = open(sFile, "wt")
+    f.write("Time,Type,Instrument,Product,Qty.,Avg. price,Status\n")
+    for i in range(iTrades):
+        t += datetime.timedelta(minutes=r.choice([0, 1, 5, 30, 390]))
+        sym = r.choice(symbols)
+        if (r.random() < sellFraction) and (held.get(sym, 0) > 0):
+            qty = r.randint(1, held[sym])
+            held[sym] -= qty
+            sType = "SELL"
+        else:
+            qty = r.randint(1, 100)
+            held[sym] = held.get(sym, 0) + qty
+            sType = "BUY"
+        price = round(r.uniform(10, 5000), 2)
+        f.write('{},{},{},CNC,{},"{:,.2f}",COMPLETE\n'.format(t.strftime(hlpr.DTFMT_ISO), sType, sym, qty, price))
+    f.close()
+
+
+def gen_kite_holdings(sFile, iSymbols, iSeed=1):
+    """
+    Generate a KiteHoldings csv file with a holding for each of iSymbols symbols.
+    """
+    r = random.Random(iSeed)
+    f = open(sFile, "wt")
+    f.write("Instrument,Qty.,Avg. cost,LTP,Cur. val,P&L,Net chg.,Day chg.\n")
+    for sym in _symbols(iSymbols):
+        qty = r.randint(1, 1000)
+        avgPrice = round(r.uniform(10, 5000), 2)
+        ltp = round(avgPrice*r.uniform(0.5, 1.5), 2)
+        curValue = ltp*qty
+        netChg = round(((ltp/avgPrice)-1)*100, 2)
+        f.write('{},{},"{:.2f}","{:.2f}","{:.2f}","{:.2f}","{:.2f}","{:.2f}"\n'.format(sym, qty, avgPrice, ltp, curValue, curValue-avgPrice*qty, netChg, r.uniform(-5, 5)))
+    f.close()
+
+
+def gen_kite_openorders(sFile, iOrders, iSymbols, iSeed=1):
+    """
+    Generate a KiteOpenOrders csv file with iOrders orders over iSymbols symbols.
+    """
+    r = random.Random(iSeed)
+    symbols = _symbols(iSymbols)
+    t = datetime.datetime(2021, 1, 1, 9, 15)
+    f = open(sFile, "wt")
+    f.write("Time,Type,Instrument,Product,Qty.,LTP,Price,Status\n")
+    for i in range(iOrders):
+        t += datetime.timedelta(seconds=r.randint(0, 60))
+        ltp = round(r.uniform(10, 5000), 2)
+        price = round(ltp*r.uniform(0.8, 1.2), 2)
+        f.write('{},{},{},CNC,0/{},"{:.2f}","{:.2f}",OPEN\n'.format(t.strftime(hlpr.DTFMT_ISO), r.choice(["BUY", "SELL"]), r.choice(symbols), r.randint(1, 100), ltp, price))
+    f.close()
+
+
+def gen_h7_o1(sFile, iTrades, iSymbols, iSeed=1):
+    """
+    Generate a H7O1 csv file with iTrades buys over iSymbols symbols.
+    """
+    r = random.Random(iSeed)
+    symbols = _symbols(iSymbols)
+    t = datetime.datetime(2010, 1, 1, 9, 15)
+    f = open(sFile, "wt")
+    f.write("Id,Time,Symbol,Total,Price,Qty\n")
+    for i in range(iTrades):
+        t += datetime.timedelta(minutes=r.choice([1, 30, 390]))
+        qty = r.randint(1, 100)
+        price = round(r.uniform(10, 5000), 2)
+        f.write('{},{},{},"{}","{}",{}\n'.format(i, t.strftime(hlpr.DTFMT_IST), r.choice(symbols), price*qty, price, qty))
+    f.close()
+
+
+def gen_h7_funds(sFile, iEntries, iSeed=1):
+    """
+    Generate a H7Funds csv file with iEntries cash flows.
+    """
+    r = random.Random(iSeed)
+    t = datetime.datetime(2010, 1, 1, 10, 0)
+    f = open(sFile, "wt")
+    f.write("Time,Amount\n")
+    for i in range(iEntries):
+        t += datetime.timedelta(days=r.randint(1, 30))
+        f.write('{},"{:.2f}"\n'.format(t.strftime(hlpr.DTFMT_IST), r.uniform(-20000, 100000)))
+    f.close()
+
+
+def gen_files(sDir, iTrades, iSymbols, iSeed=1):
+    """
+    Generate a set of csv files of the given size in sDir, returning the csvType to file map.
+    """
+    files = {}
+    for csvType, genFunc, args in [
+            ('KiteTrades', gen_kite_trades, (iTrades, iSymbols)),
+            ('KiteHoldings', gen_kite_holdings, (iSymbols,)),
+            ('KiteOpenOrders', gen_kite_openorders, (max(iTrades//100, 10), iSymbols)),
+            ('H7O1', gen_h7_o1, (iTrades, iSymbols)),
+            ('H7Funds', gen_h7_funds, (max(iTrades//100, 10),)),
+            ]:
+        files[csvType] = os.path.join(sDir, "{}-{}-{}.csv".format(csvType, iTrades, iSymbols))
+        genFunc(files[csvType], *args, iSeed=iSeed)
+    return files
+
+
+#
+# Benchmark harness
+#
+def timeit(func, iRepeat=1):
+    """
+    Time the given function, returning the best time in seconds across iRepeat
+    runs, along with the result of the last run. Any printing is discarded.
+    """
+    best = None
+    for i in range(iRepeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tStart = time.perf_counter()
+            res = func()
+            tTaken = time.perf_counter() - tStart
+        best = tTaken if (best == None) else min(best, tTaken)
+    return best, res
+
+
+def bench_size(sDir, iTrades, iSymbols, iRepeat=1):
+    """
+    Run the benchmarks for a given data size, returning the list of results.
+    """
+    files = gen_files(sDir, iTrades, iSymbols)
+    results = []
+    def add(sName, tTaken, iRows):
+        results.append({ 'name': sName, 'trades': iTrades, 'symbols': iSymbols, 'rows': iRows, 'seconds': tTaken })
+
+    f = open(files['KiteTrades'])
+    lines = f.readlines()
+    f.close()
+    tTaken, res = timeit(lambda: [ hlpr.csv2list(l) for l in lines ], iRepeat)
+    add('hlpr.csv2list', tTaken, len(lines))
+    tTaken, res = timeit(lambda: [ hlpr.csv2list_fast(l) for l in lines ], iRepeat)
+    add('hlpr.csv2list_fast', tTaken, len(lines))
+
+    das = {}
+    for csvType in files:
+        tTaken, das[csvType] = timeit(lambda: csv.import_csv(csvType, files[csvType]), iRepeat)
+        add('csv.import_csv:{}'.format(csvType), tTaken, len(das[csvType]))
+
+    da = das['KiteTrades']
+    daBuys = da[da[:,adb.IBS['QTY']] > 0]
+    daSells = da[da[:,adb.IBS['QTY']] < 0]
+    tTaken, cdb = timeit(lambda: adb.import_da(adb.cdb_new(), daBuys), iRepeat)
+    add('adb.import_da:buys', tTaken, len(daBuys))
+    tTaken = None
+    for i in range(iRepeat):
+        cdb = adb.import_da(adb.cdb_new(), daBuys)
+        tCur, cdb = timeit(lambda: adb.import_da(cdb, daSells))
+        tTaken = tCur if (tTaken == None) else min(tTaken, tCur)
+    add('adb.import_da:sells', tTaken, len(daSells))
+    tTaken, db = timeit(lambda: adb.import_da(None, da), iRepeat)
+    add('adb.import_da:buysells', tTaken, len(da))
+
+    tTaken, res = timeit(lambda: adb.list_assets(db), iRepeat)
+    add('adb.list_assets', tTaken, len(db))
+    tTaken, res = timeit(lambda: adb.list_assets(cdb), iRepeat)
+    add('adb.list_assets:cdb', tTaken, cdb['len'])
+    tTaken, res = timeit(lambda: kite.list_kite_holdings(das['KiteHoldings']), iRepeat)
+    add('kite.list_kite_holdings', tTaken, len(das['KiteHoldings']))
+    return results
+
+
+def run(sizes, iSymbols, iRepeat=1, sDir=None):
+    """
+    Run the benchmarks for each of the given trade counts, returning the report dict.
+    """
+    csv.init()
+    if sDir == None:
+        tmpDir = tempfile.TemporaryDirectory()
+        sDir = tmpDir.name
+    else:
+        tmpDir = None
+        os.makedirs(sDir, exist_ok=True)
+    results = []
+    for iTrades in sizes:
+        results.extend(bench_size(sDir, iTrades, iSymbols, iRepeat))
+    if tmpDir != None:
+        tmpDir.cleanup()
+    return {
+        'meta': {
+            'time': datetime.datetime.now().strftime(hlpr.DTFMT_ISO),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'repeat': iRepeat,
+            },
+        'results': results,
+        }
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark AssetsDB import, matching and listing")
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated list of trade counts")
+    parser.add_argument("--symbols", type=int, default=50, help="number of symbols")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per benchmark, the best is reported")
+    parser.add_argument("--dir", default=None, help="dir to keep the generated csv files in")
+    parser.add_argument("--out", default=None, help="file to write the json results to, else stdout")
+    args = parser.parse_args(args)
+    report = run([ int(x) for x in args.sizes.split(",") ], args.symbols, args.repeat, args.dir)
+    sReport = json.dumps(report, indent=1)
+    if args.out == None:
+        print(sReport)
+    else:
+        f = open(args.out, "wt")
+        f.write(sReport)
+        f.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
@@ -4,54 +4,269 @@
 # GPL
 #
 
+import importlib
+import time
 import numpy
 import traceback
 
 from hlpr import *
 import generic
-import h7
-import kite
 
 
-CSVDataFile = { }
+CSVTypeModules = {
+    'Generic': 'generic',
+    'H7O1': 'h7',
+    'H7Funds': 'h7',
+    'KiteTrades': 'kite',
+    'KiteOpenOrders': 'kite',
+    'KiteHoldings': 'kite',
+    }
 
 
-def import_csv(csvType, sFile, da=None):
+class CSVDataFileRegistry(dict):
     """
-    Import csv file main flow
-    csvType: Specifies the type of csv file to import, which is used to get details like
-        the delimiter of the fields,
-        the fieldProtectors (Used to allow delimiter to be present within a fields value)
-        the number of lines to skip, if any at the begining.
-        the function used to infer the data in each line of the csv file.
-    sFile: the file to import
-    da: optional da to load the data into. If None, then a new da is created.
+    The registry of csvTypes, which imports the module handling a csvType and
+    registers its csvTypes, when the csvType is used for the 1st time.
     """
-    f = open(sFile)
-    CSVDataFile[csvType]['import_header'](CSVDataFile, f, csvType)
-    #breakpoint()
+
+    def __missing__(self, csvType):
+        if csvType not in CSVTypeModules:
+            raise KeyError(csvType)
+        importlib.import_module(CSVTypeModules[csvType]).init_csv(self)
+        return dict.__getitem__(self, csvType)
+
+
+CSVDataFile = CSVDataFileRegistry()
+
+
+CSVBULKREADSIZE = 4*1024*1024
+
+
+def _lines_before(sFile, iOffset):
+    """
+    Return the number of lines in the file before the given byte offset.
+    """
+    iLines = 0
+    f = open(sFile, "rb")
+    while iOffset > 0:
+        data = f.read(min(iOffset, CSVBULKREADSIZE))
+        if len(data) == 0:
+            break
+        iLines += data.count(b"\n")
+        iOffset -= len(data)
+    f.close()
+    return iLines
+
+
+def _diag_record(l, la):
+    """
+    Handle a record which couldnt be imported, as per the diagnostics policy.
+    """
+    if diag_policy() == 'prompt':
+        traceback.print_exc()
+    diag("RecordError", "ERRR:ImportCSV:{}:{}".format(la, traceback.format_exc(0).strip()), l)
+
+
+def _import_csv_lines(csvType, f, iLineNo=0):
+    """
+    Import csv file records line by line, growing the da for each record.
+    """
+    da = None
     for l in f:
+        stats_count("csv.lines")
+        iLineNo += 1
+        gDiagContext['lineNo'] = iLineNo
         la = csv2list(l, CSVDataFile[csvType]['delim'], CSVDataFile[csvType]['fieldProtectors'])
         #print("DBUG:ImportCSV:CurLine:", l, la)
         try:
             la = CSVDataFile[csvType]['import_record'](CSVDataFile, l, la)
             if (type(la) == type(None)):
+                stats_count("csv.records.skipped")
                 continue
+            stats_count("csv.records")
             dprint("INFO:ImportCSV:{}".format(la), gDEBUGLVLINFO)
             if (type(da) == type(None)):
                 da = numpy.array(la, dtype=object)
             else:
                 da = numpy.vstack((da, numpy.array(la, dtype=object)))
+        except DiagError:
+            raise
         except:
             #print(sys.exc_info())
-            traceback.print_exc()
-            input("ERRR:ImportCSV:{}".format(la))
+            stats_count("csv.records.errors")
+            _diag_record(l, la)
+    return da
+
+
+def _csv_records(csvType, f, iLineNo=0):
+    """
+    Yield the records of the csv file, as returned by the csvType's import_record,
+    reading the file in large chunks of lines and tokenising them using csv2list_fast.
+    Records whose number of fields differ from the 1st record are not yielded.
+    iLineNo: the number of lines in the file before the current position, used
+        to track the line number of any anomalies.
+    The lines, records and errors are counted a chunk at a time, and if stats
+    are enabled, the time taken to tokenise and import the records is noted,
+    the latter including the time taken by the consumer of the records.
+    """
+    delim = CSVDataFile[csvType]['delim']
+    fieldProtectors = CSVDataFile[csvType]['fieldProtectors']
+    import_record = CSVDataFile[csvType]['import_record']
+    bDebug = dprint_enabled(gDEBUGLVLINFO)
+    bStats = gStats['enabled']
+    sRecordTimer = "csv.import_record:{}".format(csvType)
+    iFields = -1
+    while True:
+        lines = f.readlines(CSVBULKREADSIZE)
+        if len(lines) == 0:
+            break
+        tStart = time.perf_counter() if bStats else 0
+        las = [ csv2list_fast(l, delim, fieldProtectors) for l in lines ]
+        if bStats:
+            stats_time("hlpr.csv2list_fast", time.perf_counter() - tStart, len(lines))
+            tStart = time.perf_counter()
+        iSkipped = iErrors = 0
+        for l, la in zip(lines, las):
+            iLineNo += 1
+            gDiagContext['lineNo'] = iLineNo
+            try:
+                la = import_record(CSVDataFile, l, la)
+                if (type(la) == type(None)):
+                    iSkipped += 1
+                    continue
+                if bDebug:
+                    dprint("INFO:ImportCSV:{}".format(la), gDEBUGLVLINFO)
+                if iFields == -1:
+                    iFields = len(la)
+                elif len(la) != iFields:
+                    raise ValueError("ImportCSV:Record has {} fields instead of {}".format(len(la), iFields))
+            except DiagError:
+                raise
+            except:
+                iErrors += 1
+                _diag_record(l, la)
+                continue
+            yield la
+        if bStats:
+            stats_time(sRecordTimer, time.perf_counter() - tStart, len(lines))
+        stats_count("csv.lines", len(lines))
+        stats_count("csv.records", len(lines) - iSkipped - iErrors)
+        stats_count("csv.records.skipped", iSkipped)
+        stats_count("csv.records.errors", iErrors)
+
+
+def _records2da(records):
+    """
+    Create a da from the given list of records in one go.
+    """
+    da = numpy.empty((len(records), len(records[0])), dtype=object)
+    da[:] = records
     return da
 
 
+def _import_csv_bulk(csvType, f, iLineNo=0):
+    """
+    Import csv file records, collecting them into a list and creating the da in one go.
+    """
+    records = list(_csv_records(csvType, f, iLineNo))
+    if len(records) == 0:
+        return None
+    return _records2da(records)
+
+
+def import_csv(csvType, sFile, da=None, bBulk=True):
+    """
+    Import csv file main flow
+    csvType: Specifies the type of csv file to import, which is used to get details like
+        the delimiter of the fields,
+        the fieldProtectors (Used to allow delimiter to be present within a fields value)
+        the number of lines to skip, if any at the begining.
+        the function used to infer the data in each line of the csv file.
+    sFile: the file to import
+    da: optional da to load the data into. If None, then a new da is created.
+    bBulk: if True, the file is read and tokenised in large chunks and the da is
+        created in one go, else the file is imported line by line.
+    Any anomalies in the file are handled as per the diagnostics policy of hlpr.
+    """
+    f = open(sFile)
+    try:
+        gDiagContext['src'] = sFile
+        gDiagContext['lineNo'] = 0
+        CSVDataFile[csvType]['import_header'](CSVDataFile, f, csvType)
+        iLineNo = _lines_before(sFile, f.tell())
+        #breakpoint()
+        if bBulk:
+            daNew = _import_csv_bulk(csvType, f, iLineNo)
+        else:
+            daNew = _import_csv_lines(csvType, f, iLineNo)
+    finally:
+        f.close()
+    if (type(daNew) == type(None)):
+        return da
+    if (type(da) == type(None)):
+        return daNew
+    return numpy.vstack((da, daNew))
+
+
+def iter_csv(csvType, sFile, iBatchSize=0, iOffset=0):
+    """
+    Import csv file lazily, by yielding its records as they are read.
+    csvType: Specifies the type of csv file to import, same as for import_csv.
+    sFile: the file to import
+    iBatchSize: if 0, then yield the records one by one, else yield da
+        batches, each containing upto iBatchSize records.
+    iOffset: if beyond the header, then the records are read starting from
+        this byte offset in the file, which should be at the start of a line.
+    """
+    f = open(sFile)
+    try:
+        gDiagContext['src'] = sFile
+        gDiagContext['lineNo'] = 0
+        CSVDataFile[csvType]['import_header'](CSVDataFile, f, csvType)
+        if iOffset > f.tell():
+            f.seek(iOffset)
+        records = []
+        for la in _csv_records(csvType, f, _lines_before(sFile, f.tell())):
+            if iBatchSize <= 0:
+                yield la
+                continue
+            records.append(la)
+            if len(records) >= iBatchSize:
+                yield _records2da(records)
+                records = []
+        if len(records) > 0:
+            yield _records2da(records)
+    finally:
+        f.close()
+
+
+def _import_csv_cols(csvType, sFile):
+    """
+    Import csv file in a worker process, returning its da in the typed columnar
+    form of generic.da2cols, which is cheaper to send back to the main process.
+    """
+    da = import_csv(csvType, sFile)
+    return None if (type(da) == type(None)) else generic.da2cols(da)
+
+
+def import_csvs(csvFiles, iWorkers=None):
+    """
+    Import the given csv files in parallel, using a pool of worker processes.
+    csvFiles: a list of (csvType, sFile) pairs.
+    iWorkers: the number of worker processes, defaults to the number of cpus.
+    Returns the list of das, one for each csv file, in the same order.
+    Anomalies are collected by the workers and then handled here, as per the
+    diagnostics policy, see hlpr.pool_run.
+    """
+    results = pool_run(_import_csv_cols, [ (csvType, sFile) for csvType, sFile in csvFiles ], iWorkers)
+    return [ None if (type(res) == type(None)) else generic.cols2da(*res) for res in results ]
+
+
 def init():
-    generic.init_csv(CSVDataFile)
-    h7.init_csv(CSVDataFile)
-    kite.init_csv(CSVDataFile)
+    """
+    Register all the csvTypes in one go, instead of on their 1st use.
+    """
+    for sModule in sorted(set(CSVTypeModules.values())):
+        importlib.import_module(sModule).init_csv(CSVDataFile)
 
 
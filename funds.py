@@ -0,0 +1,214 @@
+#
+# funds - Cash flow analytics over funds data like H7Funds
+# HanishKVC, 2021
+#
+
+
+import datetime
+import numpy
+
+import adb
+import kite
+import report
+
+
+SECSINYEAR = 365*86400
+XIRRTOLERANCE = 1e-9
+XIRRMAXITERS = 100
+
+
+def funds_flows(da):
+    """
+    Return the epoch seconds and amounts of the given H7Funds da, as typed arrays sorted by time.
+    """
+    epochs = adb.dates2epoch(da[:,0]) if (len(da) > 0) else numpy.zeros(0, dtype=numpy.int64)
+    amounts = da[:,1].astype(numpy.float64)
+    order = numpy.argsort(epochs, kind='stable')
+    return epochs[order], amounts[order]
+
+
+def portfolio_value(db=None, daHoldings=None):
+    """
+    Return the current value of a portfolio.
+    If both db and KiteHoldings da are given, the in hand lots of the db are valued at the holdings LTP,
+    else if only the holdings are given, their current value is used,
+    else the in hand lots of the db are valued at cost.
+    """
+    if type(daHoldings) != type(None):
+        if type(db) != type(None):
+            lots, gs = adb.mark_to_market(db, daHoldings)
+            return float(numpy.nansum(gs['value']))
+        return float(numpy.sum(daHoldings[:,kite.IHOLDINGS['CURVALUE']].astype(numpy.float64)))
+    gs = adb.assets_summary(db)
+    return float(numpy.sum(gs['ihBSum']))
+
+
+def monthly_contributions(epochs, amounts):
+    """
+    Sum the amounts of the flows in each calendar month.
+    Returns the months (datetime64[M]) which have flows and the sum of each.
+    """
+    months = epochs.astype('datetime64[s]').astype('datetime64[M]')
+    uMonths, monthIdx = numpy.unique(months, return_inverse=True)
+    return uMonths, numpy.bincount(monthIdx.reshape(-1), weights=amounts, minlength=len(uMonths))
+
+
+def _pad_flows(flowsList):
+    """
+    Pack a list of (epochs, amounts) into 2D arrays of portfolios x flows, with
+    times in years since the first flow of each portfolio and zero amounts for padding.
+    """
+    iFlows = max([ len(f[0]) for f in flowsList ] + [ 1 ])
+    years = numpy.zeros((len(flowsList), iFlows))
+    amounts = numpy.zeros((len(flowsList), iFlows))
+    for i, (epochs, amts) in enumerate(flowsList):
+        if len(epochs) == 0:
+            continue
+        years[i,:len(epochs)] = (epochs - numpy.min(epochs))/SECSINYEAR
+        amounts[i,:len(amts)] = amts
+    return years, amounts
+
+
+def _npv(rates, years, amounts):
+    """
+    Return the net present value of each portfolio at the given rates and its derivative.
+    """
+    with numpy.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        factors = (1 + rates[:,None])**(-years)
+        npv = numpy.sum(amounts*factors, axis=1)
+        dnpv = numpy.sum(-years*amounts*factors, axis=1)/(1 + rates)
+    return npv, dnpv
+
+
+def xirr_many(flowsList, tolerance=XIRRTOLERANCE, iMaxIters=XIRRMAXITERS):
+    """
+    Solve the annualised internal rate of return of many portfolios at once.
+    flowsList: a list of (epochs, amounts) of the cash flows of each portfolio,
+        with money put into the portfolio as negative and taken out as positive.
+    Newton steps are taken for all portfolios together, falling back to bisection
+    within the bracket of each portfolio, if a step leaves it or doesnt converge.
+    A portfolio is solved once its net present value is within tolerance of the
+    total of its flows.
+    Returns a array of rates, with nan where there is no solution.
+    """
+    years, amounts = _pad_flows(flowsList)
+    iPorts = len(flowsList)
+    lo = numpy.full(iPorts, -0.999999)
+    hi = numpy.full(iPorts, 10.0)
+    fLo, d = _npv(lo, years, amounts)
+    fHi, d = _npv(hi, years, amounts)
+    for i in range(6):
+        bExpand = (numpy.sign(fLo) == numpy.sign(fHi))
+        if not numpy.any(bExpand):
+            break
+        hi[bExpand] *= 10
+        fHi, d = _npv(hi, years, amounts)
+    bValid = (numpy.sign(fLo) != numpy.sign(fHi)) & numpy.isfinite(fLo) & numpy.isfinite(fHi)
+    rates = numpy.clip(numpy.full(iPorts, 0.1), lo, hi)
+    fTolerance = tolerance*numpy.sum(numpy.abs(amounts), axis=1)
+    for i in range(iMaxIters):
+        f, df = _npv(rates, years, amounts)
+        bDone = (numpy.abs(f) <= fTolerance)
+        if numpy.all(bDone | ~bValid):
+            break
+        bLo = (numpy.sign(f) == numpy.sign(fLo))
+        lo = numpy.where(bLo, rates, lo)
+        fLo = numpy.where(bLo, f, fLo)
+        hi = numpy.where(bLo, hi, rates)
+        with numpy.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            newRates = rates - f/df
+        bBisect = ~numpy.isfinite(newRates) | (newRates <= lo) | (newRates >= hi)
+        newRates[bBisect] = ((lo + hi)/2)[bBisect]
+        rates = numpy.where(bDone, rates, newRates)
+    rates[~bValid] = numpy.nan
+    return rates
+
+
+def xirr(epochs, amounts):
+    """
+    Return the annualised internal rate of return of the given cash flows.
+    """
+    return xirr_many([ (epochs, amounts) ])[0]
+
+
+def twr(valuesBefore, flows, finalValue):
+    """
+    Return the time weighted return, chaining the return of each sub period between flows.
+    valuesBefore: the value of the portfolio just before each flow.
+    flows: the amount put into (positive) or taken out of (negative) the portfolio at each flow.
+    finalValue: the value of the portfolio at the end.
+    Sub periods starting with no money in the portfolio are skipped.
+    """
+    starts = valuesBefore + flows
+    ends = numpy.append(valuesBefore[1:], finalValue)
+    bUse = (starts > 0)
+    return float(numpy.prod(ends[bUse]/starts[bUse]) - 1)
+
+
+def _book_values_before(db, epochs, amounts):
+    """
+    Return the book value of a portfolio just before each flow (used as a approximation
+    of its market value, when that isnt known), ie the money put in
+    till then along with the profit/loss realised by the db till then.
+    """
+    putIn = numpy.cumsum(amounts) - amounts
+    if type(db) == type(None):
+        return putIn
+    tidx = adb.time_index(db)
+    realised = numpy.append(0, numpy.cumsum(tidx['realised']))
+    return putIn + realised[numpy.searchsorted(tidx['times'], epochs, side='left')]
+
+
+def analyse_funds(fundsList, values, dbs=None, tNow=None, valuesBefore=None):
+    """
+    Analyse the funds of many portfolios at once.
+    fundsList: a list of the H7Funds da of each portfolio, with money put into the
+        portfolio as positive amounts.
+    values: the current value of each portfolio, see portfolio_value.
+    dbs: optionally the db of each portfolio, to include realised profit/loss in the
+        book values used for twrBook.
+    tNow: the time of the current values, defaults to now.
+    valuesBefore: optionally a list with, for each portfolio, the market value just
+        before each of its flows (in time order), or None if not known.
+    Returns a dict of per portfolio arrays, with
+        twr: the time weighted return, for portfolios whose valuesBefore are given, else nan.
+        twrBook: a book value approximation of the time weighted return, which values the
+            portfolio at cost (plus realised profit/loss) before each flow, so that all of
+            the unrealised gain falls into the last sub period.
+    """
+    tNow = adb.date2epoch(datetime.datetime.now() if (type(tNow) == type(None)) else tNow)
+    dbs = [ None ]*len(fundsList) if (type(dbs) == type(None)) else dbs
+    valuesBefore = [ None ]*len(fundsList) if (type(valuesBefore) == type(None)) else valuesBefore
+    res = { k: numpy.zeros(len(fundsList)) for k in [ 'deposits', 'withdrawals', 'value', 'gain', 'xirr', 'twr', 'twrBook' ] }
+    xirrFlows = []
+    for i, da in enumerate(fundsList):
+        epochs, amounts = funds_flows(da)
+        res['deposits'][i] = numpy.sum(amounts[amounts > 0])
+        res['withdrawals'][i] = numpy.sum(-amounts[amounts < 0])
+        res['value'][i] = values[i]
+        res['gain'][i] = values[i] - numpy.sum(amounts)
+        bFlows = (len(epochs) > 0)
+        res['twr'][i] = twr(numpy.asarray(valuesBefore[i], dtype=numpy.float64), amounts, values[i]) if (bFlows and (type(valuesBefore[i]) != type(None))) else numpy.nan
+        res['twrBook'][i] = twr(_book_values_before(dbs[i], epochs, amounts), amounts, values[i]) if bFlows else numpy.nan
+        xirrFlows.append((numpy.append(epochs, tNow), numpy.append(-amounts, values[i])))
+    res['xirr'] = xirr_many(xirrFlows)
+    return res
+
+
+def list_funds_analysis(names, fundsList, values, dbs=None, tNow=None, bMonthly=False, valuesBefore=None):
+    """
+    List the analysis of the funds of the given portfolios.
+    TWR is listed only if the valuations before each flow are given, while
+    TWRBook is the book value approximation, see analyse_funds.
+    Returns the table of the listed analysis.
+    """
+    res = analyse_funds(fundsList, values, dbs, tNow, valuesBefore)
+    tbl = report.table([ 'name', 'deposits', 'withdrawals', 'value', 'gain', 'xirrPct', 'twrPct', 'twrBookPct' ],
+            [ numpy.array(names, dtype=object) ] + [ res[k] for k in [ 'deposits', 'withdrawals', 'value', 'gain' ] ] + [ res[k]*100 for k in [ 'xirr', 'twr', 'twrBook' ] ])
+    sFormat = "{:32} : Deposits={:16.2f}, Withdrawals={:16.2f}, Value={:16.2f}, Gain={:16.2f} : XIRR={:8.2f}%, TWR={:8.2f}%, TWRBook={:8.2f}%"
+    lines = report.render_lines(tbl, sFormat)
+    if bMonthly:
+        for i in range(len(names)):
+            months, sums = monthly_contributions(*funds_flows(fundsList[i]))
+            lines[i] += "".join([ "\n\t{} : {:16.2f}".format(m, s) for m, s in zip(months, sums) ])
+    return report.emit(tbl, sFormat, "", "", "\n\n" if adb.gbSpaceOutListing else "\n", lines)
@@ -5,6 +5,11 @@
 
 
 import datetime
+import json
+import os
+import numpy
+
+import report
 
 
 def init_csv(CSVDataFile):
@@ -43,28 +48,160 @@ def list(npa, fieldTypes=None):
             F: float field
             O: query field value to find the field type
         if None, then query field value to find the field type
+    The rows are rendered a column at a time and output in one go.
+    Returns the table of the contents, see report.table.
+    """
+    cols, colTypes = da2cols(npa) if (len(npa) > 0) else ({}, "")
+    lines = numpy.full(len(npa), "", dtype=object)
+    for iF in range(len(colTypes)):
+        lines = lines + _list_col(npa[:,iF], cols["c{}".format(iF)], colTypes[iF], None if (fieldTypes == None) else fieldTypes[iF]) + " "
+    tbl = report.table([ k for k in cols ], [ cols[k] for k in cols ])
+    return report.emit(tbl, None, "", "", "\n\n", lines)
+
+
+def _list_col(col, typedCol, colType, fieldType):
+    """
+    Format the given column of a object array for generic.list, as a array of strs.
+    If all values are of the same type as the fieldType (if given), the typed
+    column is formatted in one go, else value by value.
+    """
+    if (fieldType in [ None, 'O' ]) or ((fieldType == 'S') and (colType == 'S')):
+        if colType == 'S':
+            return report.format_col(typedCol, "48").astype(object)
+        if (colType == 'F') and all([ type(x) == float for x in col ]):
+            return report.format_col(typedCol, "13.2f").astype(object)
+        if colType == 'I':
+            return report.format_col(typedCol, "13").astype(object)
+        if colType == 'D':
+            return report.format_col(numpy.array([ x.strftime("%Y%m%dT%H%M") for x in col ]), "13").astype(object)
+    strs = numpy.empty(len(col), dtype=object)
+    for i, cC in enumerate(col):
+        cT = type(cC)
+        if fieldType == 'S':
+            cT = str
+        elif fieldType == 'F':
+            cT = float
+        if cT == str:
+            strs[i] = "{:48}".format(cC)
+        elif cT == float:
+            strs[i] = "{:13.2f}".format(cC)
+        elif cT == datetime.datetime:
+            strs[i] = "{:13}".format(cC.strftime("%Y%m%dT%H%M"))
+        else:
+            strs[i] = "{:13}".format(cC)
+    return strs
+
+
+STOREMETAFILE = "meta.json"
+
+
+def save_cols(sPath, cols, meta={}):
+    """
+    Save the given dict of 1D numpy arrays into the sPath directory, with each
+    array in its own .npy file, so that they can be memory mapped when loading.
+    meta: additional info to save along with the arrays.
+    Each file is written under a temp name and then renamed into place, so that
+    columns memory mapped from the same files (by load_cols) can be saved back.
+    """
+    os.makedirs(sPath, exist_ok=True)
+    for k in cols:
+        sFile = os.path.join(sPath, "{}.npy".format(k))
+        f = open(sFile + ".tmp", "wb")
+        numpy.save(f, cols[k], allow_pickle=(cols[k].dtype == object))
+        f.close()
+        os.replace(sFile + ".tmp", sFile)
+    meta = dict(meta)
+    meta['cols'] = [ k for k in cols ]
+    sFile = os.path.join(sPath, STOREMETAFILE)
+    f = open(sFile + ".tmp", "wt")
+    json.dump(meta, f)
+    f.close()
+    os.replace(sFile + ".tmp", sFile)
+
+
+def load_cols(sPath, bMMap=True):
+    """
+    Load the dict of arrays saved using save_cols, along with its meta info.
+    bMMap: if True, the arrays are memory mapped in copy on write mode, so that
+        they are read from the disk only when accessed and any changes to them
+        are not written back to the disk.
+    """
+    f = open(os.path.join(sPath, STOREMETAFILE))
+    meta = json.load(f)
+    f.close()
+    cols = {}
+    for k in meta['cols']:
+        sFile = os.path.join(sPath, "{}.npy".format(k))
+        try:
+            cols[k] = numpy.load(sFile, mmap_mode=('c' if bMMap else None))
+        except ValueError:
+            # object arrays cant be memory mapped
+            cols[k] = numpy.load(sFile, allow_pickle=True)
+    return cols, meta
+
+
+def _col_type(col):
+    """
+    Find the type of the given column of a object array, from the type of its values.
     """
-    for cR in npa:
-        iF = -1
-        for cC in cR:
-            iF += 1
-            if fieldTypes == None:
-                cT = type(cC)
-            else:
-                if fieldTypes[iF] == 'S':
-                    cT = str
-                elif fieldTypes[iF] == 'F':
-                    cT = float
-                elif fieldTypes[iF] == 'O':
-                    cT = type(cC)
-            if cT == str:
-                print("{:48}".format(cC), end=" ")
-            elif cT == float:
-                print("{:13.2f}".format(cC), end=" ")
-            elif cT == datetime.datetime:
-                print("{:13}".format(cC.strftime("%Y%m%dT%H%M")), end=" ")
-            else:
-                print("{:13}".format(cC), end=" ")
-        print("\n")
+    colTypes = set([ type(x) for x in col ])
+    if colTypes == set([str]):
+        return 'S'
+    if colTypes == set([datetime.datetime]):
+        return 'D'
+    if colTypes == set([int]):
+        return 'I'
+    if colTypes.issubset(set([int, float])):
+        return 'F'
+    return 'O'
 
 
+def da2cols(da):
+    """
+    Convert the given 2D object array into a dict of typed numpy arrays, one per
+    column, where possible. Returns the dict and the type char of each column.
+    """
+    cols = {}
+    colTypes = ""
+    for i in range(da.shape[1]):
+        cT = _col_type(da[:,i])
+        if cT == 'S':
+            col = da[:,i].astype(str)
+        elif cT == 'D':
+            col = da[:,i].astype('datetime64[s]')
+        elif cT == 'I':
+            col = da[:,i].astype(numpy.int64)
+        elif cT == 'F':
+            col = da[:,i].astype(numpy.float64)
+        else:
+            col = da[:,i]
+        cols["c{}".format(i)] = col
+        colTypes += cT
+    return cols, colTypes
+
+
+def cols2da(cols, colTypes):
+    """
+    Convert the dict of typed columns created by da2cols back into a 2D object array.
+    """
+    da = numpy.empty((len(cols['c0']) if len(cols) > 0 else 0, len(colTypes)), dtype=object)
+    for i in range(len(colTypes)):
+        da[:,i] = cols["c{}".format(i)].astype(object) if colTypes[i] != 'O' else cols["c{}".format(i)]
+    return da
+
+
+def save_da(da, sPath):
+    """
+    Save the given 2D object array into the sPath directory, in a columnar form,
+    with each column stored as a typed numpy array, where possible.
+    """
+    cols, colTypes = da2cols(da)
+    save_cols(sPath, cols, { 'kind': 'da', 'colTypes': colTypes })
+
+
+def load_da(sPath, bMMap=True):
+    """
+    Load a 2D object array saved using save_da.
+    """
+    cols, meta = load_cols(sPath, bMMap)
+    return cols2da(cols, meta['colTypes'])
@@ -4,11 +4,11 @@
 #
 
 
-import datetime
 import numpy
 
 from hlpr import *
 import generic
+import report
 
 
 def init_csv(CSVDataFile):
@@ -29,15 +29,15 @@ def init_csv(CSVDataFile):
         }
 
 
-def _handle_asset_csv_o1(la):
-    tDate = datetime.datetime.strptime(la[1], "%Y%m%dIST%H%M")
+def _handle_asset_csv_o1(la, l=None):
+    tDate = parse_datetime(la[1], DTFMT_IST)
     tSymbol = fix_symbol(la[2])
     tTotal = float(la[3].replace(",",""))
     tValue = float(la[4].replace(",", ""))
     tQty = int(la[5].replace(",", ""))
     tCheck = tValue*tQty
     if (abs(tTotal - tCheck) > 0.001):
-        input("DBUG:ImportCSVO1:TotalValue mismatch:{}:{}".format(la, tCheck))
+        diag("TotalValueMismatch", "DBUG:ImportCSVO1:TotalValue mismatch:{}:{}".format(la, tCheck), l)
     return [ tSymbol, tDate, tValue, tQty, tTotal ]
 
 
@@ -54,7 +54,7 @@ def _import_o1_record(csvDF, l, la):
         return None
     if la[2][0].strip().startswith("#"):
         return None
-    la = _handle_asset_csv_o1(la)
+    la = _handle_asset_csv_o1(la, l)
     return la
 
 
@@ -64,20 +64,17 @@ def _import_funds_record(csvDF, l, la):
     The csv file should consist of Time, Amount
     """
     if len(la) != 2:
-        input("WARN:ImportFunds: CSV file format might have changed...")
+        diag("FormatChanged", "WARN:ImportFunds: CSV file format might have changed...", l)
         return None
     fi = csvDF['H7Funds']['FieldIndex']
-    tDate = datetime.datetime.strptime(la[fi['TIME']], "%Y%m%dIST%H%M")
+    tDate = parse_datetime(la[fi['TIME']], DTFMT_IST)
     tAmount = float(la[fi['AMOUNT']].replace(",", ""))
     return [ tDate, tAmount ]
 
 
 def list_funds(da):
-    tSum = 0
-    for x in da:
-        tSum += x[1]
-        tDate = x[0].strftime("%Y%m%dIST%H%M")
-        print("{:16} {:8.2f}".format(tDate, x[1]), end="\n\n")
-    print("{:16} : {}".format("TotalValue", tSum))
+    tbl = report.table([ 'date', 'amount' ], [ numpy.array([ x.strftime("%Y%m%dIST%H%M") for x in da[:,0] ], dtype=str), da[:,1].astype(numpy.float64) ])
+    tSum = sum(da[:,1].tolist())
+    return report.emit(tbl, "{:16} {:8.2f}", "", "{:16} : {}\n".format("TotalValue", tSum), "\n\n")
 
 
@@ -4,7 +4,12 @@
 #
 
 
+import datetime
+import functools
+import importlib.util
 import re
+import sys
+import time
 
 
 gDEBUGLVLERROR = 0
@@ -24,6 +29,258 @@ def dprint(msg, dbgLvl=None):
     print(msg)
 
 
+def lazy_import(sModule):
+    """
+    Import the given module lazily, ie its code is run only when one of its
+    attributes is accessed for the 1st time.
+    """
+    if sModule in sys.modules:
+        return sys.modules[sModule]
+    spec = importlib.util.find_spec(sModule)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[sModule] = module
+    loader.exec_module(module)
+    return module
+
+
+def dprint_enabled(dbgLvl=None):
+    """
+    Check if dprint will print messages of the given debug level, so that
+    callers can avoid building such messages, when they wont be printed.
+    """
+    dbgLvl = gDEBUGLVLDEFAULT if (dbgLvl == None) else dbgLvl
+    return (dbgLvl <= gDEBUGLVLTHRESHOLD)
+
+
+#
+# Diagnostics
+#
+DIAGPOLICIES = [ 'prompt', 'collect', 'raise', 'skip' ]
+gDiagPolicy = 'prompt'
+gDiags = []
+gDiagContext = { 'src': None, 'lineNo': None }
+
+
+class DiagError(Exception):
+    """
+    Raised for a anomaly, when the diagnostics policy is raise.
+    """
+    def __init__(self, diagEntry):
+        Exception.__init__(self, diagEntry['msg'])
+        self.diag = diagEntry
+
+
+def diag_policy(sPolicy=None):
+    """
+    Set the diagnostics policy, if given, returning the current policy.
+    prompt: print the anomaly and wait for the user (the default).
+    collect: record the anomaly into the diagnostics report and continue.
+    raise: raise a DiagError.
+    skip: ignore the anomaly.
+    """
+    global gDiagPolicy
+    if sPolicy != None:
+        if sPolicy not in DIAGPOLICIES:
+            raise ValueError("Diag:Unknown policy {}, should be one of {}".format(sPolicy, DIAGPOLICIES))
+        gDiagPolicy = sPolicy
+    return gDiagPolicy
+
+
+def diag(sReason, msg, sLine=None):
+    """
+    Handle a anomaly as per the diagnostics policy.
+    sReason: a short reason tag for the anomaly.
+    msg: the message describing the anomaly.
+    sLine: the raw line (or data) which has the anomaly, if any.
+    The source and line number are taken from gDiagContext, as set by the importer.
+    """
+    if gDiagPolicy == 'skip':
+        return
+    if gDiagPolicy == 'prompt':
+        input(msg)
+        return
+    diagEntry = {
+        'src': gDiagContext['src'],
+        'lineNo': gDiagContext['lineNo'],
+        'line': sLine.rstrip("\n") if (type(sLine) == str) else sLine,
+        'reason': sReason,
+        'msg': msg,
+        }
+    if gDiagPolicy == 'raise':
+        raise DiagError(diagEntry)
+    gDiags.append(diagEntry)
+
+
+def diag_report(bClear=False):
+    """
+    Return the list of anomalies collected till now, clearing them if requested.
+    """
+    report = list(gDiags)
+    if bClear:
+        del gDiags[:]
+    return report
+
+
+def diag_replay(diags):
+    """
+    Handle the anomalies collected elsewhere, say by a worker process, as per the diagnostics policy.
+    """
+    for diagEntry in diags:
+        if gDiagPolicy == 'skip':
+            return
+        if gDiagPolicy == 'prompt':
+            input(diagEntry['msg'])
+            continue
+        if gDiagPolicy == 'raise':
+            raise DiagError(diagEntry)
+        gDiags.append(diagEntry)
+
+
+def list_diags(report=None):
+    """
+    Print the given or collected diagnostics report, along with a count of each reason.
+    """
+    report = gDiags if (report == None) else report
+    reasons = {}
+    for d in report:
+        print("{}:{}:{}: {}".format(d['src'], d['lineNo'], d['reason'], d['line']))
+        reasons[d['reason']] = reasons.get(d['reason'], 0) + 1
+    for sReason in reasons:
+        print("{:32} : {}".format(sReason, reasons[sReason]))
+
+
+#
+# Instrumentation
+#
+gStats = { 'enabled': False, 'counters': {}, 'timers': {} }
+
+
+def stats_enable(bEnable=True):
+    """
+    Switch on (or off) the timers. Counters are always kept, as they are
+    updated in bulk and so cost little.
+    """
+    gStats['enabled'] = bEnable
+
+
+def stats_reset():
+    gStats['counters'].clear()
+    gStats['timers'].clear()
+
+
+def stats_count(sName, iCount=1):
+    counters = gStats['counters']
+    counters[sName] = counters.get(sName, 0) + iCount
+
+
+def stats_time(sName, tTaken, iCount=1):
+    """
+    Add the time taken by iCount operations to the given timer.
+    """
+    timer = gStats['timers'].get(sName)
+    if timer == None:
+        timer = gStats['timers'][sName] = [ 0, 0.0 ]
+    timer[0] += iCount
+    timer[1] += tTaken
+
+
+def stats_merge(counters, timers):
+    """
+    Add the given counters and timers, say from a worker process, to the stats.
+    """
+    for sName in counters:
+        stats_count(sName, counters[sName])
+    for sName in timers:
+        stats_time(sName, timers[sName][1], timers[sName][0])
+
+
+def _cache_counts():
+    """
+    Return the hits and misses of the parse caches of this process, as counters.
+    """
+    counters = {}
+    for sName, func in [ ('hlpr.parse_datetime', parse_datetime), ('hlpr.fix_symbol', fix_symbol) ]:
+        ci = func.cache_info()
+        counters[sName+".hits"] = ci.hits
+        counters[sName+".misses"] = ci.misses
+    return counters
+
+
+def _worker_run(func, args, bStats):
+    """
+    Run func(*args) in a pool worker process, with anomalies always collected, as
+    there is no user to prompt, returning the result along with the anomalies and
+    the instrumentation stats of the worker, including its parse cache hits and misses.
+    """
+    diag_policy('collect')
+    diag_report(True)
+    stats_reset()
+    stats_enable(bStats)
+    cacheCounts = _cache_counts()
+    res = func(*args)
+    for sName, iCount in _cache_counts().items():
+        stats_count(sName, iCount - cacheCounts[sName])
+    return res, diag_report(True), (gStats['counters'], gStats['timers'])
+
+
+def pool_run(func, argsList, iWorkers=None):
+    """
+    Run func for each of the given tuples of args, in a pool of worker processes.
+    iWorkers: the number of worker processes, defaults to the number of cpus.
+    The anomalies collected by the workers are handled here as per the diagnostics
+    policy, and their stats are added to the instrumentation stats.
+    Returns the list of results, in the same order as argsList.
+    """
+    import concurrent.futures
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(iWorkers) as pool:
+        futures = [ pool.submit(_worker_run, func, args, gStats['enabled']) for args in argsList ]
+        for fut in futures:
+            res, diags, stats = fut.result()
+            stats_merge(*stats)
+            diag_replay(diags)
+            results.append(res)
+    return results
+
+
+def stats_dump(bPrint=True):
+    """
+    Return the counters and timers, along with the hit rates of the parse caches
+    (of this process and of the pool workers), printing them if requested.
+    """
+    stats = { 'counters': dict(gStats['counters']), 'timers': {} }
+    for sName in gStats['timers']:
+        stats['timers'][sName] = list(gStats['timers'][sName])
+    for sName, iCount in _cache_counts().items():
+        stats['counters'][sName] = stats['counters'].get(sName, 0) + iCount
+    if bPrint:
+        for sName in sorted(stats['counters']):
+            print("STAT:Count:{:40}: {:12}".format(sName, stats['counters'][sName]))
+        for sName in sorted(stats['timers']):
+            iCount, tTaken = stats['timers'][sName]
+            print("STAT:Time:{:41}: {:12} calls {:12.6f}s {:10.3f}us/call".format(sName, iCount, tTaken, (tTaken/iCount)*1e6 if iCount > 0 else 0))
+    return stats
+
+
+def stats_profile(func, *args, sFile=None, iTop=25, **kwargs):
+    """
+    Run func(*args, **kwargs) under cProfile, printing the iTop functions by cumulative
+    time, and saving the profile into sFile if given. Returns the result of func.
+    """
+    import cProfile
+    import pstats
+    prof = cProfile.Profile()
+    try:
+        res = prof.runcall(func, *args, **kwargs)
+    finally:
+        if sFile != None:
+            prof.dump_stats(sFile)
+        pstats.Stats(prof, stream=sys.stdout).sort_stats('cumulative').print_stats(iTop)
+    return res
+
+
 def csv2list(inL, delim=DELIMITER, fieldProtectors = FIELDPROTECTORS):
     """
     Convert a csv line into a python list.
@@ -48,24 +305,143 @@ def csv2list(inL, delim=DELIMITER, fieldProtectors = FIELDPROTECTORS):
     return tA
 
 
+gCSVProtectorsRE = {}
+
+
+def csv2list_fast(inL, delim=DELIMITER, fieldProtectors=FIELDPROTECTORS):
+    """
+    Convert a csv line into a python list, giving the same result as csv2list,
+    but by splitting the line at the fieldProtectors and then at the delim,
+    instead of going char by char.
+    delim: the character used to delimit the fields
+    fieldProtectors: characters that could be used to protect fields having delim char in them.
+    """
+    inL = inL.strip()
+    if not inL.endswith(delim):
+        inL += delim
+    fpKey = "".join(fieldProtectors)
+    fpRE = gCSVProtectorsRE.get(fpKey)
+    if fpRE == None:
+        fpRE = re.compile("[{}]".format(re.escape(fpKey))) if (len(fpKey) > 0) else None
+        gCSVProtectorsRE[fpKey] = fpRE
+    if (fpRE == None) or (fpRE.search(inL) == None):
+        return inL.split(delim)[:-1]
+    tA = []
+    curToken = ""
+    bProtectedToken = False
+    for part in fpRE.split(inL):
+        if bProtectedToken:
+            curToken += part
+        else:
+            fields = part.split(delim)
+            curToken += fields[0]
+            for field in fields[1:]:
+                tA.append(curToken)
+                curToken = field
+        bProtectedToken = not bProtectedToken
+    return tA
+
+
+DATECACHESIZE = 64*1024
+DTFMT_ISO = "%Y-%m-%d %H:%M:%S"
+DTFMT_IST = "%Y%m%dIST%H%M"
+
+
+def _isdigits(s):
+    return s.isdigit() and s.isascii()
+
+
+def _fast_iso(sDate):
+    if (len(sDate) != 19) or (sDate[4] != '-') or (sDate[7] != '-') or (sDate[10] != ' ') or (sDate[13] != ':') or (sDate[16] != ':'):
+        return None
+    if not _isdigits(sDate[0:4]+sDate[5:7]+sDate[8:10]+sDate[11:13]+sDate[14:16]+sDate[17:19]):
+        return None
+    return datetime.datetime(int(sDate[0:4]), int(sDate[5:7]), int(sDate[8:10]), int(sDate[11:13]), int(sDate[14:16]), int(sDate[17:19]))
+
+
+def _fast_ist(sDate):
+    if (len(sDate) != 15) or (sDate[8:11] != "IST"):
+        return None
+    if not _isdigits(sDate[0:8]+sDate[11:15]):
+        return None
+    return datetime.datetime(int(sDate[0:4]), int(sDate[4:6]), int(sDate[6:8]), int(sDate[11:13]), int(sDate[13:15]))
+
+
+DateParsers = {
+    DTFMT_ISO: _fast_iso,
+    DTFMT_IST: _fast_ist,
+    }
+
+
+@functools.lru_cache(maxsize=DATECACHESIZE)
+def parse_datetime(sDate, sFormat):
+    """
+    Convert the given date string into a datetime object, same as datetime.strptime,
+    but using fixed format parsers for the commonly used formats and caching the
+    results, as many records share the same time.
+    NOTE: If a fixed format parser cant handle the string, strptime is used.
+    """
+    if gStats['enabled']:
+        tStart = time.perf_counter()
+        dt = _parse_datetime(sDate, sFormat)
+        stats_time("hlpr.parse_datetime.miss", time.perf_counter() - tStart)
+        return dt
+    return _parse_datetime(sDate, sFormat)
+
+
+def _parse_datetime(sDate, sFormat):
+    parser = DateParsers.get(sFormat)
+    if parser != None:
+        try:
+            dt = parser(sDate)
+        except ValueError:
+            dt = None
+        if dt != None:
+            return dt
+    stats_count("hlpr.strptime")
+    return datetime.datetime.strptime(sDate, sFormat)
+
+
 SymbolMap = {
         'SEARCH55AA': 'REPLACEAA55'
         }
 
 
+SYMBOLSUFFIXES = [ "-BE", "-BZ" ]
+SYMBOLCACHESIZE = 64*1024
+gSymbolRE = None
+
+
 def symbolmap_append(inMap):
+    """
+    Add the given symbol mappings to SymbolMap, clearing the cached symbol normalisations.
+    """
     global SymbolMap
     for k in inMap:
         SymbolMap[k] = inMap[k]
+    fix_symbol.cache_clear()
 
 
+def _symbol_re():
+    """
+    Return the compiled regex which splits a symbol into its stem and any of the
+    SYMBOLSUFFIXES, which is to be dropped.
+    """
+    global gSymbolRE
+    if gSymbolRE == None:
+        sSuffixes = "|".join([ re.escape(s) for s in SYMBOLSUFFIXES ])
+        gSymbolRE = re.compile("(?P<symbol>.*?)(?:{})?".format(sSuffixes), re.DOTALL)
+    return gSymbolRE
+
+
+@functools.lru_cache(maxsize=SYMBOLCACHESIZE)
 def fix_symbol(symbol):
-    symSuffix = symbol[-3:]
-    if symSuffix in [ "-BE", "-BZ" ]:
-        symbol = symbol[:-3]
-    if symbol in SymbolMap:
-        symbol = SymbolMap[symbol]
-    return symbol
+    """
+    Normalise the symbol, by dropping any -BE/-BZ suffix and mapping it as per SymbolMap.
+    The results are cached, so SymbolMap should be updated using symbolmap_append.
+    """
+    symbol = _symbol_re().fullmatch(symbol).group('symbol')
+    return SymbolMap.get(symbol, symbol)
 
 
 def print_dict(d, msg=None):
@@ -75,10 +451,52 @@ def print_dict(d, msg=None):
         print("{}:\n\t{}".format(k,d[k]))
 
 
+@functools.lru_cache(maxsize=256)
+def _match_any_re(matchTuple):
+    """
+    Compile the given match patterns into a single alternation regex, or into a
+    list of regexs if they cant be combined, say due to inline flags or groups
+    (whose backreferences would get renumbered).
+    """
+    cREs = [ re.compile(cM) for cM in matchTuple ]
+    if any([ cRE.groups > 0 for cRE in cREs ]):
+        return cREs
+    try:
+        return [ re.compile("|".join([ "(?:{})".format(cM) for cM in matchTuple ])) ]
+    except re.error:
+        return cREs
+
+
 def match_any(matchList, theStr):
-    for cM in matchList:
-        if re.match(cM, theStr) != None:
+    for cRE in _match_any_re(tuple(matchList)):
+        if cRE.match(theStr) != None:
             return True
     return False
 
 
+def match_any_names(matchList, names):
+    """
+    Check which of the given names match any of the patterns in matchList, with
+    each unique name checked only once. An empty matchList matches all names.
+    Returns a bool array with a entry for each name.
+    """
+    import numpy
+    names = numpy.asarray(names, dtype=object)
+    if len(matchList) == 0:
+        return numpy.ones(len(names), dtype=bool)
+    if len(names) == 0:
+        return numpy.zeros(0, dtype=bool)
+    uNames, nameIdx = numpy.unique(names, return_inverse=True)
+    bMatch = numpy.array([ match_any(matchList, an) for an in uNames ], dtype=bool)
+    return bMatch[nameIdx.reshape(-1)]
+
+
+def div_or_zero(values, divisors):
+    """
+    Return values/divisors as a float array, with 0 where the divisor is 0.
+    """
+    import numpy
+    res = numpy.zeros(len(divisors))
+    mask = (divisors != 0)
+    res[mask] = values[mask]/divisors[mask]
+    return res
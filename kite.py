@@ -4,10 +4,33 @@
 #
 
 
-import datetime
 import numpy
 
 from hlpr import *
+import report
+
+
+IHOLDINGS = {
+    'SYMBOL': 0,
+    'LTP': 1,
+    'AVGPRICE': 2,
+    'QTY': 3,
+    'CURVALUE': 4,
+    'NETCHG': 5,
+    'DAYCHG': 6,
+    }
+
+IOPENORDERS = {
+    'TIME': 0,
+    'SYMBOL': 1,
+    'PRICE': 2,
+    'QTY': 3,
+    'VALUE': 4,
+    'LTP': 5,
+    'PRICERATIO': 6,
+    }
+
+OONEARLTPPCT = 1.0
 
 
 def init_csv(CSVDataFile):
@@ -39,10 +62,10 @@ def _import_kite_trades_record(csvDF, l, la):
     Import the csv file generated when exporting trades from kite
     """
     if len(la) != 7:
-        input("WARN:ImportKiteTrades: CSV file format might have changed...")
+        diag("FormatChanged", "WARN:ImportKiteTrades: CSV file format might have changed...", l)
         return None
     fi = csvDF['KiteTrades']['FieldIndex']
-    tDate = datetime.datetime.strptime(la[fi['TIME']], "%Y-%m-%d %H:%M:%S")
+    tDate = parse_datetime(la[fi['TIME']], DTFMT_ISO)
     tType = 1 if (la[fi['TYPE']] == 'BUY') else -1
     tSymbol = fix_symbol(la[fi['INSTRUMENT']])
     tQty = int(la[fi['QTY']].replace(",", ""))*tType
@@ -57,10 +80,10 @@ def _import_kite_openorders_record(csvDF, l, la):
     NOTE: Assumes that the open orders have not been partially fullfilled.
     """
     if len(la) != 8:
-        input("WARN:ImportKiteOpenOrders: CSV file format might have changed...")
+        diag("FormatChanged", "WARN:ImportKiteOpenOrders: CSV file format might have changed...", l)
         return None
     fi = csvDF['KiteOpenOrders']['FieldIndex']
-    tDate = datetime.datetime.strptime(la[fi['TIME']], "%Y-%m-%d %H:%M:%S")
+    tDate = parse_datetime(la[fi['TIME']], DTFMT_ISO)
     tType = 1 if (la[fi['TYPE']] == 'BUY') else -1
     tSymbol = fix_symbol(la[fi['INSTRUMENT']])
     tQty = int(la[fi['QTY']].split('/')[1].replace(",", ""))*tType
@@ -71,16 +94,136 @@ def _import_kite_openorders_record(csvDF, l, la):
 
 
 def list_kite_openorders(da):
+    oo = openorders_cols(da)
     theFormat = "{:32} {:8} {:8.2f} {:8.2f} {:8.2f}"
     theHFormat = theFormat.replace(".2f","")
-    print(theHFormat.format("Symbol", "Qty", "Price", "LTP", "%Chg"), end="\n\n")
-    tSum = 0
-    for x in da:
-        tSum += x[4]
-        print(theFormat.format(x[1], x[3], x[2], x[5], (x[6]-1)*100), end="\n\n")
-    print("{:16} : {}".format("TotalValue", tSum))
-    print("{:16} : {}".format("TotalBuy", numpy.sum(da[da[:,4]>0,4])))
-    print("{:16} : {}".format("TotalSell", numpy.sum(da[da[:,4]<0,4])))
+    sHead = theHFormat.format("Symbol", "Qty", "Price", "LTP", "%Chg") + "\n\n"
+    tbl = report.table([ 'symbol', 'qty', 'price', 'ltp', 'chgPct' ], [ oo['symbol'], oo['qty'], oo['price'], oo['ltp'], (da[:,IOPENORDERS['PRICERATIO']].astype(numpy.float64)-1)*100 ])
+    sTail = "{:16} : {}\n".format("TotalValue", sum(oo['value'].tolist()))
+    sTail += "{:16} : {}\n".format("TotalBuy", sum(oo['value'][oo['value']>0].tolist()))
+    sTail += "{:16} : {}\n".format("TotalSell", sum(oo['value'][oo['value']<0].tolist()))
+    return report.emit(tbl, theFormat, sHead, sTail, "\n\n")
+
+
+def openorders_cols(da):
+    """
+    Convert the KiteOpenOrders da into a typed table, with a entry per order,
+    so that the analytics below work on typed columns.
+    qty and value are positive for buy orders and negative for sell orders, and
+    distPct is the % difference of the order price from the LTP.
+    """
+    price = da[:,IOPENORDERS['PRICE']].astype(numpy.float64)
+    ltp = da[:,IOPENORDERS['LTP']].astype(numpy.float64)
+    return report.table([ 'time', 'symbol', 'price', 'qty', 'value', 'ltp', 'distPct' ], [
+        numpy.asarray(da[:,IOPENORDERS['TIME']], dtype=object).astype('datetime64[s]'),
+        da[:,IOPENORDERS['SYMBOL']],
+        price,
+        da[:,IOPENORDERS['QTY']].astype(numpy.int64),
+        da[:,IOPENORDERS['VALUE']].astype(numpy.float64),
+        ltp,
+        (div_or_zero(price, ltp) - 1)*100,
+        ])
+
+
+def openorders_exposure(oo):
+    """
+    Sum up the buy and sell orders of each symbol, in one pass.
+    oo: the typed table of open orders, see openorders_cols.
+    Returns a typed table with a entry per symbol (in name order), with the count,
+    qty and value of its buy and sell orders (as positive amounts), the net qty and
+    value if all of them get filled, and the LTP (as per its last order).
+    """
+    symbols, codes = numpy.unique(oo['symbol'], return_inverse=True)
+    codes = codes.reshape(-1)
+    n = len(symbols)
+    bBuy = (oo['qty'] > 0)
+    def group_sum(values):
+        return numpy.bincount(codes, weights=values, minlength=n)
+    def group_isum(values):
+        return numpy.rint(group_sum(values)).astype(numpy.int64)
+    iLast = numpy.zeros(n, dtype=numpy.int64)
+    numpy.maximum.at(iLast, codes, numpy.arange(len(codes)))
+    buyQty = group_isum(oo['qty']*bBuy)
+    sellQty = group_isum(-oo['qty']*~bBuy)
+    buyValue = group_sum(numpy.where(bBuy, oo['value'], 0.0))
+    sellValue = group_sum(numpy.where(bBuy, 0.0, -oo['value']))
+    return report.table([ 'symbol', 'buyOrders', 'buyQty', 'buyValue', 'sellOrders', 'sellQty', 'sellValue', 'netQty', 'netValue', 'ltp' ], [
+        symbols, group_isum(bBuy), buyQty, buyValue, group_isum(~bBuy), sellQty, sellValue,
+        buyQty - sellQty, buyValue - sellValue, oo['ltp'][iLast] if (n > 0) else numpy.zeros(0),
+        ])
+
+
+def openorders_ladder(oo):
+    """
+    Arrange the orders of each symbol into a ladder, with the buy orders going from
+    the highest price down and the sell orders from the lowest price up, ie from
+    the nearest to the farthest from getting filled, along with the cumulative qty
+    and value upto each rung.
+    Returns a typed table with a entry per order, in symbol, side (buys first) and rung order.
+    """
+    bSell = (oo['qty'] < 0)
+    order = numpy.lexsort((oo['time'], numpy.where(bSell, oo['price'], -oo['price']), bSell, oo['symbol']))
+    lo = oo[order]
+    bSell = bSell[order]
+    qty = numpy.abs(lo['qty'])
+    value = numpy.abs(lo['value'])
+    iRows = numpy.arange(len(lo))
+    bStart = numpy.ones(len(lo), dtype=bool)
+    bStart[1:] = (lo['symbol'][1:] != lo['symbol'][:-1]) | (bSell[1:] != bSell[:-1])
+    iStarts = numpy.maximum.accumulate(numpy.where(bStart, iRows, 0)) if (len(lo) > 0) else iRows
+    cumQty = numpy.cumsum(qty)
+    cumValue = numpy.cumsum(value)
+    return report.table([ 'symbol', 'side', 'rung', 'price', 'qty', 'cumQty', 'cumValue', 'ltp', 'distPct', 'time' ], [
+        lo['symbol'], numpy.where(bSell, "SELL", "BUY"), iRows - iStarts, lo['price'], qty,
+        cumQty - cumQty[iStarts] + qty[iStarts], cumValue - cumValue[iStarts] + value[iStarts],
+        lo['ltp'], lo['distPct'], lo['time'],
+        ])
+
+
+def openorders_near_ltp(oo, pct=OONEARLTPPCT):
+    """
+    Return the orders whose price is within pct % of the LTP, nearest first.
+    """
+    dist = numpy.abs(oo['distPct'])
+    rows = numpy.flatnonzero(dist <= pct)
+    return oo[rows[numpy.argsort(dist[rows], kind='stable')]]
+
+
+def openorders_if_filled(oo, daHoldings):
+    """
+    Join the exposure of the open orders with the given KiteHoldings da, to find
+    the position in each symbol if all of its open orders get filled.
+    Buys add to the qty and invested value at their order price, while sells reduce
+    the qty at the average price.
+    Returns a typed table with a entry per symbol in either of them (in name order),
+    with the held qty and average price, the qty, average price and value (at LTP)
+    after the fills, and whether it would end up short.
+    """
+    ex = openorders_exposure(oo)
+    hSymbols = daHoldings[:,IHOLDINGS['SYMBOL']].astype(str) if (len(daHoldings) > 0) else numpy.zeros(0, dtype=str)
+    hOrder = numpy.argsort(hSymbols, kind='stable')
+    hSymbols = hSymbols[hOrder]
+    symbols = numpy.union1d(ex['symbol'], hSymbols)
+    def lookup(keys, values):
+        res = numpy.zeros(len(symbols), dtype=values.dtype)
+        idx = numpy.searchsorted(keys, symbols)
+        bFound = (idx < len(keys))
+        bFound[bFound] = (keys[idx[bFound]] == symbols[bFound])
+        res[bFound] = values[idx[bFound]]
+        return res, bFound
+    heldQty, bHeld = lookup(hSymbols, daHoldings[hOrder,IHOLDINGS['QTY']].astype(numpy.int64))
+    heldAvg, bHeld = lookup(hSymbols, daHoldings[hOrder,IHOLDINGS['AVGPRICE']].astype(numpy.float64))
+    heldLTP, bHeld = lookup(hSymbols, daHoldings[hOrder,IHOLDINGS['LTP']].astype(numpy.float64))
+    buyQty, bOrders = lookup(ex['symbol'], ex['buyQty'])
+    buyValue, bOrders = lookup(ex['symbol'], ex['buyValue'])
+    sellQty, bOrders = lookup(ex['symbol'], ex['sellQty'])
+    orderLTP, bOrders = lookup(ex['symbol'], ex['ltp'])
+    ltp = numpy.where(bHeld, heldLTP, orderLTP)
+    fillQty = heldQty + buyQty - sellQty
+    fillAvg = div_or_zero(heldQty*heldAvg + buyValue, (heldQty + buyQty).astype(numpy.float64))
+    return report.table([ 'symbol', 'heldQty', 'heldAvg', 'buyQty', 'sellQty', 'fillQty', 'fillAvg', 'fillInvested', 'ltp', 'fillValue', 'short' ], [
+        symbols, heldQty, heldAvg, buyQty, sellQty, fillQty, fillAvg, fillAvg*numpy.maximum(fillQty, 0), ltp, fillQty*ltp, fillQty < 0,
+        ])
 
 
 def _import_kite_header(csvDF, f, csvType):
@@ -117,7 +260,7 @@ def _import_kite_holdings_record(csvDF, l, la):
     Import the csv file generated when exporting holdings from kite
     """
     if len(la) != 8:
-        input("WARN:ImportKiteHoldings: CSV file format might have changed...")
+        diag("FormatChanged", "WARN:ImportKiteHoldings: CSV file format might have changed...", l)
         return None
     fi = csvDF['KiteHoldings']['FieldIndex']
     tSymbol = fix_symbol(la[fi['INSTRUMENT']])
@@ -129,10 +272,10 @@ def _import_kite_holdings_record(csvDF, l, la):
     tDayChg = float(la[fi['DAYCHG']].replace(",", ""))
     tCheck = tLTP*tQty
     if (abs(tCurValue - tCheck) > 0.001):
-        input("DBUG:ImportKiteHoldings:CurValue mismatch:{}:{}".format(la, tCheck))
+        diag("CurValueMismatch", "DBUG:ImportKiteHoldings:CurValue mismatch:{}:{}".format(la, tCheck), l)
     tCheck = round(((tLTP/tAvgPrice)-1)*100,2)
     if (abs(tNetChg - tCheck) > 0.1):
-        input("DBUG:ImportKiteHoldings:NetChg mismatch:{}:{}".format(la, tCheck))
+        diag("NetChgMismatch", "DBUG:ImportKiteHoldings:NetChg mismatch:{}:{}".format(la, tCheck), l)
     return [ tSymbol, tLTP, tAvgPrice, tQty, tCurValue, tNetChg, tDayChg ]
 
 
@@ -140,9 +283,10 @@ def list_kite_holdings(da, sortBy=-2, mayBeAdj=0.98):
     theFormat = "{:32} {:8.2f} {:8.2f} {:8} {:8.2f} {:8.2f} {:8.2f} {:8.2f}"
     daN = da[numpy.argsort(da[:,sortBy])]
     theHFormat = theFormat.replace(".2f","")
-    print(theHFormat.format("Symbol", "LTP", "AvgPrice", "Qty", "CurVal", "NetChg", "DayChg", "MayBe"), end="\n\n")
-    for x in daN:
-        tMayBe = x[1]*mayBeAdj
-        print(theFormat.format(x[0], x[1], x[2], x[3], x[4], x[5], x[6], tMayBe), end="\n\n")
+    sHead = theHFormat.format("Symbol", "LTP", "AvgPrice", "Qty", "CurVal", "NetChg", "DayChg", "MayBe") + "\n\n"
+    ltps = daN[:,1].astype(numpy.float64)
+    tbl = report.table([ 'symbol', 'ltp', 'avgPrice', 'qty', 'curValue', 'netChg', 'dayChg', 'mayBe' ],
+            [ daN[:,0], ltps, daN[:,2].astype(numpy.float64), daN[:,3].astype(numpy.int64), daN[:,4].astype(numpy.float64), daN[:,5].astype(numpy.float64), daN[:,6].astype(numpy.float64), ltps*mayBeAdj ])
+    return report.emit(tbl, theFormat, sHead, "", "\n\n")
 
 
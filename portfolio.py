@@ -0,0 +1,126 @@
+#
+# portfolio - Hold the dbs of many accounts, as shards of a portfolio
+# HanishKVC, 2021
+# GPL
+#
+# A portfolio is a dict with pf['dbs'] mapping each account to its own columnar
+# db. As sells never cross accounts, each shard is imported and matched on its
+# own, and consolidated summaries are built by merging the per shard summaries.
+#
+
+
+import os
+import numpy
+
+from hlpr import *
+import generic
+import csv
+import adb
+
+
+def portfolio_new(accounts=[]):
+    """
+    Create a new portfolio, with a empty db for each of the given accounts.
+    """
+    pf = { 'dbs': {} }
+    for sAccount in accounts:
+        pf['dbs'][sAccount] = adb.cdb_new()
+    return pf
+
+
+def portfolio_db(pf, sAccount):
+    """
+    Return the db of the given account, creating a empty one if required.
+    """
+    if sAccount not in pf['dbs']:
+        pf['dbs'][sAccount] = adb.cdb_new()
+    return pf['dbs'][sAccount]
+
+
+def _import_shard(cdb, csvFiles):
+    """
+    Import the transactions in the given csv files into the db of a account, in time order.
+    """
+    das = [ csv.import_csv(csvType, sFile) for csvType, sFile in csvFiles ]
+    das = [ da for da in das if (type(da) != type(None)) and (len(da) > 0) ]
+    if len(das) > 0:
+        adb.import_da(cdb, adb.merge_das(das))
+    return cdb
+
+
+def import_csvs(pf, accountFiles, iWorkers=None):
+    """
+    Import the given csv files into the dbs of their accounts, with each account
+    parsed and matched in its own worker process.
+    accountFiles: a dict of account to a list of (csvType, sFile) pairs.
+    iWorkers: the number of worker processes, defaults to the number of cpus.
+    A single account is imported in this process itself. Anomalies in the workers
+    are collected and then handled here, see hlpr.pool_run.
+    """
+    accounts = list(accountFiles)
+    if len(accounts) == 1:
+        _import_shard(portfolio_db(pf, accounts[0]), accountFiles[accounts[0]])
+        return pf
+    cdbs = pool_run(_import_shard, [ (portfolio_db(pf, sAccount), accountFiles[sAccount]) for sAccount in accounts ], iWorkers)
+    for sAccount, cdb in zip(accounts, cdbs):
+        pf['dbs'][sAccount] = cdb
+    return pf
+
+
+def assets_summary(pf, accounts=None):
+    """
+    Summarise each asset across the dbs of the given accounts (all if None), by
+    merging the per account summaries.
+    Returns a dict of per asset arrays like adb.assets_summary, with the assets in name order.
+    """
+    accounts = list(pf['dbs']) if (type(accounts) == type(None)) else accounts
+    return adb.merge_assets_summaries([ adb.assets_summary(pf['dbs'][sAccount]) for sAccount in accounts ])
+
+
+def accounts_summary(pf):
+    """
+    Summarise each account of the portfolio, from its per asset summary.
+    Returns a dict of per account arrays, with the accounts in name order.
+    """
+    accounts = sorted(pf['dbs'])
+    gss = [ adb.assets_summary(pf['dbs'][sAccount]) for sAccount in accounts ]
+    return {
+        'names': numpy.array(accounts, dtype=object),
+        'ihAssets': numpy.array([ numpy.count_nonzero(gs['ihRows']) for gs in gss ], dtype=numpy.int64),
+        'ihBQty': numpy.array([ numpy.sum(gs['ihBQty']) for gs in gss ], dtype=numpy.int64),
+        'ihBSum': numpy.array([ numpy.sum(gs['ihBSum']) for gs in gss ], dtype=numpy.float64),
+        'pl': numpy.array([ numpy.sum(gs['pl']) for gs in gss ], dtype=numpy.float64),
+        }
+
+
+def list_assets(pf, filterAssets=[], accounts=None):
+    """
+    List the consolidated data about specified assets across the accounts of the portfolio.
+    filterAssets: a list of asset names or empty list.
+    accounts: the accounts to consolidate, all if None.
+    """
+    gs = assets_summary(pf, accounts)
+    ihTotals = (numpy.count_nonzero(gs['ihRows']), numpy.sum(gs['ihBQty']), numpy.sum(gs['ihBSum']))
+    return adb.list_assets_gs(gs, match_any_names(filterAssets, gs['names']), ihTotals)
+
+
+def save_portfolio(pf, sPath):
+    """
+    Save the portfolio into the sPath directory, with the db of each account in its own sub directory.
+    """
+    shards = {}
+    for i, sAccount in enumerate(sorted(pf['dbs'])):
+        shards[sAccount] = "shard{}".format(i)
+        adb.save_db(pf['dbs'][sAccount], os.path.join(sPath, shards[sAccount]))
+    generic.save_cols(sPath, {}, { 'kind': 'portfolio', 'shards': shards })
+
+
+def load_portfolio(sPath, bMMap=True):
+    """
+    Load a portfolio saved using save_portfolio.
+    """
+    cols, meta = generic.load_cols(sPath, bMMap)
+    pf = portfolio_new()
+    for sAccount, sShard in meta['shards'].items():
+        pf['dbs'][sAccount] = adb.load_db(os.path.join(sPath, sShard), bMMap)
+    return pf
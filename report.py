@@ -0,0 +1,171 @@
+#
+# report - Render tables of results in one go, for the terminal, csv or json
+# HanishKVC, 2021
+# GPL
+#
+
+
+import datetime
+import json
+import string
+import sys
+import numpy
+
+from hlpr import *
+
+
+REPORTTARGETS = [ 'terminal', 'csv', 'json' ]
+gReport = { 'target': 'terminal', 'file': '-' }
+
+
+def report_target(sTarget=None, sFile=None):
+    """
+    Set the target of the list functions, if given, returning the current target and file.
+    sTarget: terminal (the formatted listing), csv or json (only the table).
+    sFile: the file to write into (appending to it), or - for stdout.
+    """
+    if sTarget != None:
+        if sTarget not in REPORTTARGETS:
+            raise ValueError("Report:Unknown target {}, should be one of {}".format(sTarget, REPORTTARGETS))
+        gReport['target'] = sTarget
+    if sFile != None:
+        gReport['file'] = sFile
+    return gReport['target'], gReport['file']
+
+
+def table(colNames, cols):
+    """
+    Create a table, ie a typed (structured) array, from the given column names and arrays.
+    Object columns of strings are stored as str columns.
+    """
+    cols = [ numpy.asarray(col) for col in cols ]
+    for i in range(len(cols)):
+        if (cols[i].dtype == object) and all([ type(x) == str for x in cols[i] ]):
+            cols[i] = cols[i].astype(str) if (len(cols[i]) > 0) else numpy.zeros(0, dtype=str)
+    tbl = numpy.zeros(len(cols[0]) if (len(cols) > 0) else 0, dtype=[ (n, c.dtype) for n, c in zip(colNames, cols) ])
+    for n, c in zip(colNames, cols):
+        tbl[n] = c
+    return tbl
+
+
+def format_col(col, sSpec):
+    """
+    Format all the values of the column as per the given format spec, in one go
+    for the common int, float and str specs, else value by value.
+    Returns a array of strs.
+    """
+    kind = col.dtype.kind
+    if (kind == 'f') and sSpec.endswith("f") and sSpec[:-1].replace(".", "").isdigit():
+        return numpy.char.mod("%" + sSpec, col)
+    if (kind in "iu") and sSpec.isdigit():
+        return numpy.char.mod("%" + sSpec + "d", col)
+    if (kind == 'U') and sSpec.isdigit():
+        return numpy.char.mod("%-" + sSpec + "s", col)
+    return numpy.array([ format(x, sSpec) for x in col.tolist() ], dtype=str)
+
+
+def render_lines(tbl, sFormat):
+    """
+    Render each row of the table using the given str.format style line format,
+    whose fields are filled in column order, formatting a column at a time.
+    Returns a array of lines.
+    """
+    lines = numpy.full(len(tbl), "", dtype=object)
+    iCol = 0
+    for sLiteral, sField, sSpec, sConv in string.Formatter().parse(sFormat):
+        if sLiteral != "":
+            lines = lines + sLiteral
+        if sField != None:
+            lines = lines + format_col(tbl[tbl.dtype.names[iCol]], sSpec).astype(object)
+            iCol += 1
+    return lines
+
+
+def output(sText, sFile=None, sMode="at"):
+    """
+    Write the given text in one go into the given file (the report file if None), or stdout if -.
+    sMode: the mode used to open the file. By default the text is appended, so that
+        the listings of a session follow one another in the report file, thus a
+        existing report file should be removed, if a fresh one is required.
+    """
+    sFile = gReport['file'] if (sFile == None) else sFile
+    if sFile == "-":
+        sys.stdout.write(sText)
+    else:
+        f = open(sFile, sMode)
+        f.write(sText)
+        f.close()
+
+
+def _value(v):
+    if isinstance(v, numpy.generic):
+        v = v.item()
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        return v.strftime(DTFMT_ISO)
+    if isinstance(v, (list, tuple, numpy.ndarray)):
+        return str(list(v))
+    return v
+
+
+def report2rows(res):
+    """
+    Convert a report, ie a dict of per entity arrays, a typed (structured) array
+    or a list of dicts, into a list of column names and a list of rows.
+    For dicts of arrays, only the arrays with a entry per entity are used.
+    """
+    if type(res) == numpy.ndarray:
+        cols = list(res.dtype.names)
+        return cols, [ [ _value(x[c]) for c in cols ] for x in res ]
+    if type(res) == list:
+        cols = list(res[0].keys()) if (len(res) > 0) else []
+        return cols, [ [ _value(x[c]) for c in cols ] for x in res ]
+    n = len(res['names'])
+    cols = [ k for k in res if (type(res[k]) == numpy.ndarray) and (res[k].ndim == 1) and (len(res[k]) == n) and (k not in [ 'starts', 'ends' ]) ]
+    cols.remove('names')
+    cols.insert(0, 'names')
+    return cols, [ [ _value(res[c][i]) for c in cols ] for i in range(n) ]
+
+
+def _csv_field(v):
+    s = "" if (v == None) else str(v)
+    if (s.find(",") != -1) or (s.find('"') != -1) or (s.find("\n") != -1):
+        s = '"{}"'.format(s.replace('"', '""'))
+    return s
+
+
+def render(res, sFormat="json"):
+    """
+    Render the given report as csv or json text.
+    """
+    cols, rows = report2rows(res)
+    if sFormat == "csv":
+        lines = [ ",".join([ _csv_field(c) for c in cols ]) ]
+        lines.extend([ ",".join([ _csv_field(v) for v in row ]) for row in rows ])
+        return "\n".join(lines) + "\n"
+    if sFormat == "json":
+        return json.dumps([ dict(zip(cols, row)) for row in rows ], indent=1) + "\n"
+    raise ValueError("Report:Unknown format {}".format(sFormat))
+
+
+def write_report(res, sFormat="json", sOut="-"):
+    """
+    Write the given report as csv or json into the given file, or stdout if -.
+    The file is overwritten, as it holds only this report.
+    """
+    output(render(res, sFormat), sOut, "wt")
+
+
+def emit(tbl, sFormat, sHead="", sTail="", sLineEnd="\n", lines=None):
+    """
+    Output the table as per the report target, in one go.
+    For the terminal, each row is rendered using sFormat (unless the rendered
+    lines are given) and ended with sLineEnd, with sHead and sTail around them.
+    For csv and json, only the table is output.
+    Returns the table.
+    """
+    if gReport['target'] == 'terminal':
+        lines = render_lines(tbl, sFormat) if (type(lines) == type(None)) else lines
+        output(sHead + "".join([ l + sLineEnd for l in lines ]) + sTail)
+    else:
+        output(render(tbl, gReport['target']))
+    return tbl
@@ -0,0 +1,243 @@
+#
+# sqldb - Optional SQLite storage backend for the assets db
+# HanishKVC, 2021
+# GPL
+#
+# The lots table holds the same IDB columns as the object array based db, with
+# dates as int epoch seconds (0 if not set), along with the SEQ (order of arrival)
+# and SUB (order of lot splits) columns of the columnar db, so that db order is
+# ORDER BY BTRANSDATE, SEQ, SUB. The trans table records the transactions as
+# imported.
+#
+# Open lots are those which are yet to be sold (SQTY = 0), and are kept in a
+# partial index in FIFO order, so that matching a sell only looks at the open
+# lots of the asset being sold, oldest first.
+#
+
+
+import sqlite3
+import time
+import numpy
+
+from hlpr import *
+import adb
+
+
+IBS = adb.IBS
+
+SQLSCHEMA = """
+CREATE TABLE IF NOT EXISTS trans (
+    id INTEGER PRIMARY KEY,
+    NAME TEXT NOT NULL,
+    TRANSDATE INTEGER NOT NULL,
+    PRICE REAL NOT NULL,
+    QTY INTEGER NOT NULL,
+    TRANSVALUE REAL NOT NULL
+    );
+CREATE INDEX IF NOT EXISTS trans_name_date ON trans (NAME, TRANSDATE);
+CREATE TABLE IF NOT EXISTS lots (
+    id INTEGER PRIMARY KEY,
+    NAME TEXT NOT NULL,
+    BTRANSDATE INTEGER NOT NULL,
+    BPRICE REAL NOT NULL,
+    BQTY INTEGER NOT NULL,
+    BTRANSVALUE REAL NOT NULL,
+    STRANSDATE INTEGER NOT NULL DEFAULT 0,
+    SPRICE REAL NOT NULL DEFAULT 0,
+    SQTY INTEGER NOT NULL DEFAULT 0,
+    STRANSVALUE REAL NOT NULL DEFAULT 0,
+    SEQ INTEGER NOT NULL,
+    SUB INTEGER NOT NULL DEFAULT 0
+    );
+CREATE INDEX IF NOT EXISTS lots_name_bdate ON lots (NAME, BTRANSDATE, SEQ, SUB);
+CREATE INDEX IF NOT EXISTS lots_open ON lots (NAME, BTRANSDATE, SEQ, SUB) WHERE SQTY = 0;
+"""
+
+LOTCOLS = list(adb.CDBTYPES)
+
+SQLSELLLOTSBATCH = 8
+
+
+def open_db(sFile=":memory:"):
+    """
+    Open (creating if required) the given SQLite db file, returning the connection.
+    """
+    conn = sqlite3.connect(sFile)
+    conn.executescript(SQLSCHEMA)
+    return conn
+
+
+def _next_seq(conn):
+    """
+    Return the SEQ for the next buy, which is after all rows added till now, like the columnar db.
+    """
+    return conn.execute("SELECT IFNULL(MAX(id), -1) + 1 FROM lots").fetchone()[0]
+
+
+def _import_buys(conn, da):
+    """
+    Add a batch of buy transactions as open lots, in one go.
+    """
+    stats_count("sqldb.buys", len(da))
+    iSeq = _next_seq(conn)
+    seqs = list(range(iSeq, iSeq+len(da)))
+    conn.executemany("INSERT INTO lots (id, NAME, BTRANSDATE, BPRICE, BQTY, BTRANSVALUE, SEQ) VALUES (?, ?, ?, ?, ?, ?, ?)", zip(
+        seqs,
+        da[:,IBS['NAME']].tolist(),
+        adb.dates2epoch(da[:,IBS['TRANSDATE']]).tolist(),
+        da[:,IBS['PRICE']].astype(numpy.float64).tolist(),
+        da[:,IBS['QTY']].astype(numpy.int64).tolist(),
+        da[:,IBS['TRANSVALUE']].astype(numpy.float64).tolist(),
+        seqs))
+
+
+def _split_lot(conn, lot, iQty):
+    """
+    Split iQty out of the given open lot (id, BPRICE, BQTY), into a new open lot placed just before it in db order.
+    """
+    stats_count("sqldb.lots.split")
+    conn.execute("INSERT INTO lots (NAME, BTRANSDATE, BPRICE, BQTY, BTRANSVALUE, SEQ, SUB) SELECT NAME, BTRANSDATE, BPRICE, ?, BPRICE*?, SEQ, SUB-1 FROM lots WHERE id = ?", (iQty, iQty, lot[0]))
+
+
+def _import_sell(conn, ci):
+    """
+    Insert the given sell transaction into the db, by matching it with the open
+    lots of the asset, going from oldest to latest, as found in the open lots index.
+    """
+    stats_count("sqldb.sells")
+    iRemaining = -1*int(ci[IBS['QTY']])
+    sDate = adb.date2epoch(ci[IBS['TRANSDATE']])
+    sPrice = float(ci[IBS['PRICE']])
+    iLotsSold = 0
+    while iRemaining > 0:
+        lots = conn.execute("SELECT id, BPRICE, BQTY FROM lots WHERE NAME = ? AND SQTY = 0 AND BQTY > 0 ORDER BY BTRANSDATE, SEQ, SUB LIMIT ?", (ci[IBS['NAME']], SQLSELLLOTSBATCH)).fetchall()
+        if len(lots) == 0:
+            break
+        sold = []
+        for lot in lots:
+            iLotsSold += 1
+            if lot[2] <= iRemaining:
+                sold.append((sDate, sPrice, sPrice, lot[0]))
+                iRemaining -= lot[2]
+            else:
+                _split_lot(conn, lot, lot[2] - iRemaining)
+                conn.execute("UPDATE lots SET BQTY = ?, BTRANSVALUE = BPRICE*? WHERE id = ?", (iRemaining, iRemaining, lot[0]))
+                sold.append((sDate, sPrice, sPrice, lot[0]))
+                iRemaining = 0
+            if iRemaining == 0:
+                break
+        conn.executemany("UPDATE lots SET STRANSDATE = ?, SPRICE = ?, SQTY = BQTY, STRANSVALUE = ?*BQTY WHERE id = ?", sold)
+    stats_count("sqldb.lots.sold", iLotsSold)
+    if iRemaining > 0:
+        stats_count("sqldb.sells.short")
+        diag("ShortSell", "WARN:SqlImportSell:OpenShortedAssetNotSupported:{}".format(ci), ci)
+
+
+def import_da(conn, da):
+    """
+    Import the buy and sell transactions in the given da into the sql db, in a single transaction.
+    The transactions are recorded in the trans table, runs of buy transactions are
+    added as lots using executemany, while sells are matched against the open lots in FIFO order.
+    """
+    if (type(da) == type(None)) or (len(da) == 0):
+        return conn
+    gDiagContext['src'] = "SqlImportDA"
+    gDiagContext['lineNo'] = None
+    tStart = time.perf_counter() if gStats['enabled'] else 0
+    with conn:
+        conn.executemany("INSERT INTO trans (NAME, TRANSDATE, PRICE, QTY, TRANSVALUE) VALUES (?, ?, ?, ?, ?)", zip(
+            da[:,IBS['NAME']].tolist(),
+            adb.dates2epoch(da[:,IBS['TRANSDATE']]).tolist(),
+            da[:,IBS['PRICE']].astype(numpy.float64).tolist(),
+            da[:,IBS['QTY']].astype(numpy.int64).tolist(),
+            da[:,IBS['TRANSVALUE']].astype(numpy.float64).tolist()))
+        daIsBuy = (da[:,IBS['QTY']] > 0).astype(bool)
+        iRuns = numpy.flatnonzero(daIsBuy[1:] != daIsBuy[:-1]) + 1
+        for daRun in numpy.split(da, iRuns):
+            if daRun[0,IBS['QTY']] > 0:
+                _import_buys(conn, daRun)
+                continue
+            for ci in daRun:
+                _import_sell(conn, ci)
+    if gStats['enabled']:
+        stats_time("sqldb.import_da", time.perf_counter() - tStart)
+    stats_count("sqldb.import_da.records", len(da))
+    return conn
+
+
+def save_db(conn, db):
+    """
+    Replace the lots in the sql db with those of the given db, in a single transaction.
+    db: either a object array db or a columnar db.
+    """
+    cdb = db if (type(db) == dict) else adb.cdb_from_db(db)
+    adb.cdb_compact(cdb)
+    n = len(cdb['NAME'])
+    with conn:
+        conn.execute("DELETE FROM lots")
+        conn.executemany("INSERT INTO lots (id, {}, SEQ) VALUES (?, {}, ?)".format(", ".join(LOTCOLS), ", ".join([ "?" ]*len(LOTCOLS))), zip(
+            range(n),
+            numpy.array(cdb['names'], dtype=object)[cdb['NAME']].tolist(),
+            *[ cdb[k].tolist() for k in LOTCOLS[1:] ],
+            range(n)))
+    return conn
+
+
+def _filter_sql(conn, filterAssets):
+    """
+    Return the WHERE clause selecting the lots of the assets matching filterAssets.
+    The filter is evaluated once for each distinct asset name (from the name index),
+    and the matching names are kept in a temp table, so that the lots are then
+    selected through the name index.
+    """
+    if len(filterAssets) == 0:
+        return ""
+    names = numpy.array([ r[0] for r in conn.execute("SELECT DISTINCT NAME FROM lots") ], dtype=object)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS filternames (NAME TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.filternames")
+    conn.executemany("INSERT INTO temp.filternames (NAME) VALUES (?)", [ (an,) for an in names[match_any_names(filterAssets, names)].tolist() ])
+    return "WHERE NAME IN (SELECT NAME FROM temp.filternames)"
+
+
+def load_cdb(conn, filterAssets=[]):
+    """
+    Load the lots of the assets matching filterAssets (all if empty) from the sql db,
+    into a columnar db, in db order.
+    """
+    rows = conn.execute("SELECT {} FROM lots {} ORDER BY BTRANSDATE, SEQ, SUB".format(", ".join(LOTCOLS), _filter_sql(conn, filterAssets))).fetchall()
+    cols = list(zip(*rows)) if (len(rows) > 0) else [ [] ]*len(LOTCOLS)
+    return adb.cdb_from_cols(dict(zip(LOTCOLS, cols)))
+
+
+def assets_summary(conn, filterAssets=[]):
+    """
+    Summarise each asset matching filterAssets (all if empty) in the sql db, within
+    sql, grouping the lots by name.
+    Returns a dict of per asset arrays like adb.assets_summary, with the assets in name order.
+    """
+    rows = conn.execute("""SELECT NAME, COUNT(*), SUM(BQTY), TOTAL(BTRANSVALUE), SUM(SQTY), TOTAL(STRANSVALUE),
+            SUM(SQTY = 0), SUM(CASE WHEN SQTY = 0 THEN BQTY ELSE 0 END), TOTAL(CASE WHEN SQTY = 0 THEN BTRANSVALUE ELSE 0 END),
+            TOTAL(CASE WHEN SQTY > 0 THEN STRANSVALUE - BTRANSVALUE ELSE 0 END)
+            FROM lots {} GROUP BY NAME ORDER BY NAME""".format(_filter_sql(conn, filterAssets))).fetchall()
+    gs = { 'names': numpy.array([ r[0] for r in rows ], dtype=object) }
+    for i, k in enumerate(adb.ASUMTYPES):
+        gs[k] = numpy.array([ r[i+1] for r in rows ], dtype=adb.ASUMTYPES[k])
+    return gs
+
+
+def inhand_totals(conn):
+    """
+    Return the count of in hand assets in the sql db, along with their total qty and invested value.
+    """
+    return conn.execute("SELECT COUNT(DISTINCT NAME), IFNULL(SUM(BQTY), 0), TOTAL(BTRANSVALUE) FROM lots WHERE SQTY = 0").fetchone()
+
+
+def list_assets(conn, filterAssets=[], bDetails=False):
+    """
+    List the data about specified assets in the sql db, like adb.list_assets,
+    with only the lots of the matching assets being summarised (or loaded for details).
+    filterAssets: a list of asset names or empty list.
+    """
+    gs = assets_summary(conn, filterAssets)
+    dba = load_cdb(conn, filterAssets) if bDetails else None
+    return adb.list_assets_gs(gs, numpy.ones(len(gs['names']), dtype=bool), inhand_totals(conn), dba)